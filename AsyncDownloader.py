@@ -0,0 +1,197 @@
+from ETF import ETF
+from HttpSession import HttpSession, MemoryStore
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm  # progress bar
+import asyncio
+import random
+import time
+import urllib.error
+import urllib.parse
+
+"""
+Concurrent ETF downloader.
+ETFs are built in worker threads driven by an asyncio event loop; every page
+request goes back through the loop, where it is bounded by a global and a
+per-host concurrency limit, spaced by a per-host rate limit and retried with
+exponential backoff.
+"""
+
+# host suffix -> (max concurrent requests, max requests per second or None)
+HOST_LIMITS = {
+    'etfdb.com': (4, 4.0),
+    'etfdailynews.com': (4, 4.0),
+    'zacks.com': (2, 2.0),
+}
+
+# responses worth retrying, anything else (e.g. 404) fails right away
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class _Host:
+    def __init__(self, concurrency, rate):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+
+    async def wait(self):
+        '''
+        Sleep until the next request slot of this host is due.
+        '''
+        if not self.interval:
+            return
+        now = time.monotonic()
+        delay = self.next_slot - now
+        self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _Fetcher:
+    '''
+    Blocking fetcher handed to ETF, runs the request on the event loop.
+    '''
+
+    def __init__(self, downloader, loop):
+        self.downloader = downloader
+        self.loop = loop
+
+    def get(self, url):
+        return asyncio.run_coroutine_threadsafe(
+            self.downloader.fetch(url), self.loop).result()
+
+
+class AsyncDownloader:
+    def __init__(self, concurrency=8, host_limits=None, default_limit=(4, None),
+                 retries=3, backoff=1.0, timeout=30, parser="html5lib",
+                 sources=None, session=None):
+        '''
+        concurrency: ETFs (and so requests) in flight at once.
+        host_limits: host suffix -> (concurrency, rate), defaults to
+        HOST_LIMITS; hosts not listed get default_limit.
+        retries, backoff: a failed request is retried up to `retries` times,
+        waiting backoff * 2^attempt seconds (with jitter) in between.
+        sources: source -> URL template overriding ETF.SOURCES, e.g. to
+        point at a local stub server.
+        session: HttpSession-like object whose get(url) returns the raw
+        page, defaults to a new pooled HttpSession with `timeout`.
+        '''
+        self.concurrency = concurrency
+        self.host_limits = host_limits if host_limits is not None else HOST_LIMITS
+        self.default_limit = default_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.parser = parser
+        self.sources = sources
+        if session is None:
+            session = HttpSession(timeout=timeout, max_per_host=concurrency,
+                                  store=MemoryStore())
+        self.session = session
+        self.stats = {'etfs': 0, 'errors': 0, 'requests': 0, 'retries': 0,
+                      'bytes': 0, 'callback_errors': 0, 'seconds': 0}
+
+    def run(self, tickers, callback=None, progress=True, budget=None):
+        '''
+        Download all tickers, in order. callback(ticker, etf, error) is
+        called from a worker thread as soon as each ETF is done (etf is None
+        on error). With a time budget in seconds, no new ticker is started
+        once it is spent. Returns the run stats.
+        '''
+        tickers = list(tickers)
+        pbar = tqdm(total=len(tickers), unit="ETF") if progress else None
+        start = time.monotonic()
+        self._deadline = start + budget if budget is not None else None
+        try:
+            asyncio.run(self._run(tickers, callback, pbar))
+        finally:
+            self.stats['seconds'] = time.monotonic() - start
+            if pbar is not None:
+                pbar.close()
+        return self.stats
+
+    async def _run(self, tickers, callback, pbar):
+        loop = asyncio.get_running_loop()
+        self._requests = asyncio.Semaphore(self.concurrency)
+        self._hosts = {}
+        queue = asyncio.Queue()
+        for ticker in tickers:
+            queue.put_nowait(ticker)
+        fetcher = _Fetcher(self, loop)
+        with ThreadPoolExecutor(self.concurrency, "etf") as workers, \
+                ThreadPoolExecutor(self.concurrency, "http") as io:
+            self._io = io
+            await asyncio.gather(*[
+                self._worker(queue, loop, workers, fetcher, callback, pbar)
+                for _ in range(min(self.concurrency, len(tickers)))])
+
+    async def _worker(self, queue, loop, workers, fetcher, callback, pbar):
+        while not queue.empty():
+            if self._deadline is not None and time.monotonic() > self._deadline:
+                return
+            ticker = queue.get_nowait()
+            if pbar is not None:
+                pbar.set_description("Processing %s" % ticker)
+            ok, callback_ok = await loop.run_in_executor(
+                workers, self._build, ticker, fetcher, callback)
+            self.stats['etfs' if ok and callback_ok else 'errors'] += 1
+            if not callback_ok:
+                self.stats['callback_errors'] += 1
+            if pbar is not None:
+                pbar.set_postfix(requests=self.stats['requests'],
+                                 retries=self.stats['retries'],
+                                 errors=self.stats['errors'])
+                pbar.update()
+
+    def _build(self, ticker, fetcher, callback):
+        '''
+        (ETF built, callback succeeded); callback errors are printed, so
+        they cannot stop the worker.
+        '''
+        try:
+            etf = ETF(ticker, parser=self.parser, fetcher=fetcher,
+                      sources=self.sources)
+            error = None
+        except Exception as e:
+            etf, error = None, e
+        if callback is not None:
+            try:
+                callback(ticker, etf, error)
+            except Exception as e:
+                print("Callback failed for {}: {}".format(ticker, e))
+                return error is None, False
+        return error is None, True
+
+    def _host(self, url):
+        hostname = urllib.parse.urlsplit(url).hostname or ''
+        key = next((suffix for suffix in self.host_limits
+                    if hostname == suffix or hostname.endswith('.' + suffix)),
+                   hostname)
+        if key not in self._hosts:
+            self._hosts[key] = _Host(*self.host_limits.get(key, self.default_limit))
+        return self._hosts[key]
+
+    async def fetch(self, url):
+        '''
+        Fetch a page within the concurrency and rate limits, with retries.
+        '''
+        loop = asyncio.get_running_loop()
+        host = self._host(url)
+        for attempt in range(self.retries + 1):
+            # host slot first: tasks queued on a saturated or rate-limited
+            # host must not hold global slots other hosts could use
+            async with host.semaphore:
+                await host.wait()
+                async with self._requests:
+                    self.stats['requests'] += 1
+                    try:
+                        body = await loop.run_in_executor(self._io, self.session.get, url)
+                        self.stats['bytes'] += len(body)
+                        return body
+                    except urllib.error.HTTPError as e:
+                        if (e.code not in RETRY_STATUS or attempt == self.retries or
+                                getattr(self.session, 'offline', False)):
+                            raise
+                    except OSError:  # URLError, timeouts, connection resets
+                        if attempt == self.retries:
+                            raise
+            self.stats['retries'] += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
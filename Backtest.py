@@ -0,0 +1,168 @@
+from PortfolioOptimizer import RISK_FREE_RATE
+import numpy as np
+import pandas as pd
+
+"""
+Vectorized backtest of many portfolios at once, as in the performance
+section of OptimalPortfolio.Rmd (Return.portfolio with quarterly
+rebalancing, table.CAPM, table.AnnualizedReturns, SharpeRatio).
+Between rebalancing dates every portfolio drifts with its assets: its value
+path is the target weights times the cumulative growth of each asset, one
+matrix product per rebalancing period for all portfolios together.
+"""
+
+SCALE = 12  # monthly returns
+
+# rebalance_on -> pandas period frequency
+PERIODS = {'months': 'M', 'quarters': 'Q', 'years': 'A'}
+
+
+def net_returns(returns, expense_ratios):
+    '''
+    Returns minus the monthly expenses (the Rmd
+    sweep(returns, 2, expense_ratios/12)), NaN as 0: what cannot be bought
+    cannot be profited from.
+    '''
+    expenses = np.asarray(expense_ratios, dtype=np.float64) / SCALE
+    return (returns - expenses).fillna(0)
+
+
+def rebalance_starts(index, rebalance_on="quarters"):
+    '''
+    Row positions where target weights are restored: the first row and the
+    first row of every new month / quarter / year. rebalance_on=None never
+    rebalances (buy and hold), an int rebalances every that many rows.
+    '''
+    if rebalance_on is None:
+        return np.array([0])
+    if isinstance(rebalance_on, int):
+        return np.arange(0, len(index), rebalance_on)
+    periods = pd.DatetimeIndex(index).to_period(PERIODS[rebalance_on])
+    return np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+
+
+def weight_matrix(weights, assets):
+    '''
+    (portfolios, assets) array and portfolio names of Series, assets x
+    portfolios DataFrame (as RandomOptimizer.weights()) or array weights.
+    '''
+    if isinstance(weights, pd.Series):
+        weights = weights.to_frame(weights.name if weights.name is not None else 0)
+    if isinstance(weights, pd.DataFrame):
+        weights = weights.reindex(assets).fillna(0)
+        return weights.to_numpy(dtype=np.float64).T, list(weights.columns)
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    return weights, list(range(weights.shape[0]))
+
+
+def portfolio_returns(returns, weights, rebalance_on="quarters"):
+    '''
+    periods x portfolios DataFrame of the returns of every portfolio,
+    rebalanced to its weights on rebalance_on (see rebalance_starts) and
+    drifting in between, as Return.portfolio. Weights not summing to one
+    are scaled, as the portfolio value starts at their sum.
+    '''
+    matrix, names = weight_matrix(weights, list(returns.columns))
+    growth = 1 + returns.to_numpy(dtype=np.float64)
+    starts = list(rebalance_starts(returns.index, rebalance_on)) + [len(growth)]
+    result = np.empty((len(growth), len(matrix)))
+    for start, end in zip(starts[:-1], starts[1:]):
+        # value of each portfolio at the end of every row of the period,
+        # per unit invested at the rebalance
+        values = np.cumprod(growth[start:end], axis=0) @ matrix.T
+        values /= matrix.sum(axis=1)
+        result[start:end] = values / np.vstack([np.ones(len(matrix)), values[:-1]]) - 1
+    return pd.DataFrame(result, index=returns.index, columns=names)
+
+
+def drawdowns(returns):
+    '''
+    Drawdown of every column from its running peak of cumulative wealth.
+    '''
+    wealth = np.cumprod(1 + np.asarray(returns, dtype=np.float64), axis=0)
+    peak = np.maximum.accumulate(np.vstack([np.ones((1, wealth.shape[1])), wealth]), axis=0)[1:]
+    drawdown = wealth / peak - 1
+    if isinstance(returns, pd.DataFrame):
+        return pd.DataFrame(drawdown, index=returns.index, columns=returns.columns)
+    return drawdown
+
+
+def annualized(returns, scale=SCALE):
+    '''
+    Geometric annualized return of every column (Return.annualized).
+    '''
+    return np.prod(1 + returns, axis=0) ** (scale / returns.shape[0]) - 1
+
+
+def metrics(returns, benchmark=None, risk_free=RISK_FREE_RATE, scale=SCALE):
+    '''
+    Performance table, one row per column of `returns`, in one vectorized
+    pass: annualized return, standard deviation and Sharpe ratio, max
+    drawdown and its length, and against `benchmark` (a returns Series)
+    alpha (annualized), beta, Treynor ratio, active premium, tracking error
+    and information ratio, as table.CAPM and table.AnnualizedReturns.
+    '''
+    names = list(returns.columns) if isinstance(returns, pd.DataFrame) else None
+    r = np.asarray(returns, dtype=np.float64)
+    excess = r - risk_free
+    table = {
+        'annualized_return': annualized(r, scale),
+        'annualized_std': r.std(axis=0, ddof=1) * np.sqrt(scale),
+    }
+    table['sharpe'] = annualized(excess, scale) / (excess.std(axis=0, ddof=1) * np.sqrt(scale))
+    drawdown = drawdowns(r)
+    table['max_drawdown'] = drawdown.min(axis=0)
+    underwater = drawdown < 0
+    table['longest_drawdown'] = longest_run(underwater)
+    if benchmark is not None:
+        b = np.asarray(benchmark, dtype=np.float64).reshape(-1)
+        b_excess = b - risk_free
+        b_centered = b_excess - b_excess.mean()
+        beta = (b_centered @ (excess - excess.mean(axis=0))) / (b_centered @ b_centered)
+        alpha = excess.mean(axis=0) - beta * b_excess.mean()
+        active = r - b[:, None]
+        table['alpha'] = (1 + alpha) ** scale - 1
+        table['beta'] = beta
+        table['treynor'] = (annualized(r, scale) - ((1 + risk_free) ** scale - 1)) / beta
+        table['active_premium'] = annualized(r, scale) - annualized(b[:, None], scale)
+        table['tracking_error'] = active.std(axis=0, ddof=1) * np.sqrt(scale)
+        table['information_ratio'] = table['active_premium'] / table['tracking_error']
+        r_centered = r - r.mean(axis=0)
+        table['correlation'] = (b - b.mean()) @ r_centered / np.sqrt(
+            ((b - b.mean()) ** 2).sum() * (r_centered ** 2).sum(axis=0))
+    return pd.DataFrame(table, index=names)
+
+
+def longest_run(mask):
+    '''
+    Longest run of True rows in every column of a boolean array.
+    '''
+    longest = np.zeros(mask.shape[1], dtype=np.int64)
+    current = np.zeros(mask.shape[1], dtype=np.int64)
+    for row in mask:
+        current = np.where(row, current + 1, 0)
+        longest = np.maximum(longest, current)
+    return longest
+
+
+def backtest(returns, weights, benchmark=None, expense_ratios=None, rebalance_on="quarters",
+             risk_free=RISK_FREE_RATE, scale=SCALE):
+    '''
+    Out-of-sample evaluation of many portfolios: net of expense_ratios (one
+    per asset, if given), rebalanced on rebalance_on. benchmark is a
+    returns Series or (returns, weights) of a rebalanced benchmark mix, like
+    the Rmd 80/20 SPY/IEF index.
+    Returns (portfolio returns DataFrame, metrics DataFrame).
+    '''
+    if expense_ratios is not None:
+        returns = net_returns(returns, expense_ratios)
+    else:
+        returns = returns.fillna(0)
+    if isinstance(benchmark, tuple):
+        benchmark_returns, benchmark_weights = benchmark
+        benchmark = portfolio_returns(benchmark_returns.fillna(0), benchmark_weights,
+                                      rebalance_on).iloc[:, 0]
+    if benchmark is not None:
+        benchmark = pd.Series(benchmark).reindex(returns.index).fillna(0)
+    result = portfolio_returns(returns, weights, rebalance_on)
+    return result, metrics(result, benchmark, risk_free, scale)
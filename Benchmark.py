@@ -0,0 +1,299 @@
+from AsyncDownloader import AsyncDownloader
+from ETF import ETF
+from ETFPage import PARSERS
+from HttpSession import HttpSession
+from Metrics import Metrics
+from ParserCheck import load_pages
+import contextlib
+import gc
+import http.server
+import io
+import json
+import os
+import threading
+import time
+import timeit
+import tracemalloc
+import urllib.error
+
+"""
+Reproducible scraper benchmarks over a saved page corpus, without any
+live site: parse time per ticker, per-section extraction (from Metrics),
+Zacks parsing, toDict / toJson, memory per ETF and end-to-end downloader
+throughput against a local server replaying the corpus, compared with a
+saved baseline.
+Corpus layout as ParserCheck: <corpus>/<TICKER>/{etfdb,holdings,zacks}.html.
+Every result is a cost (seconds, or bytes for memory): lower is better.
+"""
+
+CORPUS = "corpus"
+BASELINE = "benchmark.json"
+CONCURRENCY = (1, 4, 16)
+SUITES = ("parse", "sections", "zacks", "serialize", "memory", "throughput")
+
+
+def load_corpus(root=CORPUS):
+    '''
+    {ticker: {source: raw page}} of every ticker directory in the corpus.
+    '''
+    return {ticker: load_pages(os.path.join(root, ticker))
+            for ticker in sorted(os.listdir(root))
+            if os.path.isdir(os.path.join(root, ticker))}
+
+
+def record(tickers, root=CORPUS, session=None):
+    '''
+    Save the live pages of `tickers` into the corpus; pages a source does
+    not have (HTTP errors) are skipped.
+    '''
+    session = session or HttpSession()
+    for ticker in tickers:
+        ticker = ticker.upper()
+        os.makedirs(os.path.join(root, ticker), exist_ok=True)
+        for source, url in ETF.SOURCES.items():
+            try:
+                html = session.get(url.format(ticker))
+            except urllib.error.HTTPError as e:
+                print("{} {}: HTTP {}".format(ticker, source, e.code))
+                continue
+            with open(os.path.join(root, ticker, source + ".html"), 'wb') as f:
+                f.write(html)
+    session.close()
+
+
+def best_of(function, repeat=5, number=1):
+    '''
+    Best time of `repeat` runs, per call, as timeit recommends.
+    '''
+    return min(timeit.Timer(function).repeat(repeat, number)) / number
+
+
+def build(ticker, pages, parser, metrics=None):
+    with contextlib.redirect_stdout(io.StringIO()):  # missing field messages
+        etf = ETF.from_html(ticker, parser=parser, metrics=metrics or Metrics(), **pages)
+    etf.dataframes
+    return etf
+
+
+def bench_parse(corpus, parser, repeat=5):
+    return {'parse.' + ticker: best_of(lambda: build(ticker, pages, parser), repeat)
+            for ticker, pages in corpus.items()}
+
+
+def bench_sections(corpus, parser, repeat=5):
+    '''
+    Median time of every phase recorded by Metrics (page parse, labels,
+    each field and table, Zacks), over all tickers.
+    '''
+    metrics = Metrics()
+    for _ in range(repeat):
+        for ticker, pages in corpus.items():
+            build(ticker, pages, parser, metrics)
+    return {'section.' + name: stats['p50'] for name, stats in metrics.summary().items()}
+
+
+def bench_zacks(corpus, repeat=5):
+    results = {}
+    for ticker, pages in corpus.items():
+        if pages.get('zacks'):
+            html = pages['zacks'].decode('cp1252')
+            results['zacks.' + ticker] = best_of(lambda: ETF.zacks_holdings(html), repeat)
+    return results
+
+
+def bench_serialize(corpus, parser, repeat=5):
+    results = {}
+    for ticker, pages in corpus.items():
+        etf = build(ticker, pages, parser)
+        results['toDict.' + ticker] = best_of(etf.toDict, repeat)
+        results['toJson.' + ticker] = best_of(etf.toJson, repeat)
+    return results
+
+
+def bench_memory(corpus, parser, copies=20):
+    '''
+    Bytes allocated and kept per ETF (pages dropped, as once downloaded),
+    measured with tracemalloc over `copies` of every ticker.
+    '''
+    results = {}
+    for ticker, pages in corpus.items():
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        etfs = []
+        for _ in range(copies):
+            etf = build(ticker, pages, parser)
+            etf._pages = None
+            etfs.append(etf)
+        gc.collect()
+        results['memory.' + ticker] = (tracemalloc.get_traced_memory()[0] - before) / copies
+        tracemalloc.stop()
+        del etfs
+    return results
+
+
+class CorpusServer:
+    def __init__(self, corpus, latency=0.05):
+        '''
+        Local HTTP server replaying the corpus at /<source>/<TICKER>/, with
+        `latency` seconds per response. "TICKER-n" serves TICKER, so a few
+        corpus tickers make any number of distinct ETFs. Missing pages are 404.
+        '''
+        self.corpus = corpus
+        self.latency = latency
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                parts = self.path.strip('/').split('/')
+                ticker = parts[-1].split('-')[0].upper() if len(parts) == 2 else None
+                body = server.corpus.get(ticker, {}).get(parts[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        port = self.httpd.server_address[1]
+        self.sources = {source: 'http://127.0.0.1:{}/{}/{{}}/'.format(port, source)
+                        for source in ETF.SOURCES}
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def bench_throughput(corpus, parser, levels=CONCURRENCY, etfs=40, latency=0.05):
+    '''
+    Seconds per ETF of AsyncDownloader against the corpus server, at each
+    concurrency level.
+    '''
+    tickers = ["{}-{}".format(ticker, i) for i in range(etfs // len(corpus) + 1)
+               for ticker in corpus][:etfs]
+    results = {}
+    with CorpusServer(corpus, latency) as server:
+        for concurrency in levels:
+            session = HttpSession(max_per_host=concurrency)
+            downloader = AsyncDownloader(concurrency=concurrency,
+                                         default_limit=(concurrency, None), parser=parser,
+                                         sources=server.sources, session=session)
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = downloader.run(tickers, progress=False)
+            session.close()
+            if stats['errors']:
+                raise RuntimeError("{} ETFs failed at concurrency {}".format(
+                    stats['errors'], concurrency))
+            results['throughput.c{}'.format(concurrency)] = stats['seconds'] / len(tickers)
+    return results
+
+
+def run(corpus, parser="lxml.html", suites=SUITES, repeat=5, levels=CONCURRENCY,
+        etfs=40, latency=0.05):
+    results = {}
+    for suite in suites:
+        if suite == "parse":
+            results.update(bench_parse(corpus, parser, repeat))
+        elif suite == "sections":
+            results.update(bench_sections(corpus, parser, repeat))
+        elif suite == "zacks":
+            results.update(bench_zacks(corpus, repeat))
+        elif suite == "serialize":
+            results.update(bench_serialize(corpus, parser, repeat))
+        elif suite == "memory":
+            results.update(bench_memory(corpus, parser))
+        elif suite == "throughput":
+            results.update(bench_throughput(corpus, parser, levels, etfs, latency))
+        else:
+            raise ValueError("Unknown suite " + str(suite))
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+    Print every result next to its baseline; returns the names more than
+    `tolerance` (relative) costlier than the baseline.
+    '''
+    regressions = []
+    print("{:<44} {:>12} {:>12} {:>8}".format("benchmark", "baseline", "current", "ratio"))
+    for name, value in results.items():
+        unit = "B" if name.startswith("memory.") else "ms"
+        scale = 1 if unit == "B" else 1000
+        base = baseline.get(name)
+        if base is None or base == 0:
+            print("{:<44} {:>12} {:>10.3f}{:>2}".format(name, "-", value * scale, unit))
+            continue
+        ratio = value / base
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = " slower" if unit == "ms" else " larger"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = " faster" if unit == "ms" else " smaller"
+        print("{:<44} {:>10.3f}{:>2} {:>10.3f}{:>2} {:>8.2f}{}".format(
+            name, base * scale, unit, value * scale, unit, ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the scraper over a saved page corpus.")
+    argparser.add_argument('--corpus', default=CORPUS,
+                           help="corpus directory (default: corpus)")
+    argparser.add_argument('--record', nargs='+', metavar='TICKER',
+                           help="save the live pages of these tickers into the corpus and exit")
+    argparser.add_argument('--parser', choices=PARSERS, default="lxml.html")
+    argparser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    argparser.add_argument('--repeat', type=int, default=5,
+                           help="runs per timing, the best is kept (default: 5)")
+    argparser.add_argument('--concurrency', type=int, nargs='+', default=list(CONCURRENCY),
+                           help="downloader concurrency levels (default: 1 4 16)")
+    argparser.add_argument('--etfs', type=int, default=40,
+                           help="ETFs downloaded per concurrency level (default: 40)")
+    argparser.add_argument('--latency', type=float, default=0.05,
+                           help="seconds the corpus server waits per response (default: 0.05)")
+    argparser.add_argument('--baseline', default=BASELINE,
+                           help="baseline results file (default: benchmark.json)")
+    argparser.add_argument('--save', action='store_true',
+                           help="save the results as the new baseline")
+    argparser.add_argument('--tolerance', type=float, default=0.1,
+                           help="relative slowdown reported as a regression (default: 0.1)")
+    args = argparser.parse_args()
+
+    if args.record:
+        record(args.record, args.corpus)
+        sys.exit()
+    corpus = load_corpus(args.corpus)
+    results = run(corpus, args.parser, args.suites, args.repeat, args.concurrency,
+                  args.etfs, args.latency)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline.get('parser', args.parser) != args.parser:
+        print("Baseline was taken with the {} parser".format(baseline['parser']))
+    regressions = compare(results, baseline.get('results', {}), args.tolerance)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'parser': args.parser, 'results': results}, f, indent=1)
+    if regressions:
+        print("{} regressions over {:.0%}".format(len(regressions), args.tolerance))
+        sys.exit(1)
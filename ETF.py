@@ -1,21 +1,96 @@
-from bs4 import BeautifulSoup as bs
-import ast
-import datetime
-import html5lib
-import numpy as np
+from ETFPage import PARSERS, parse_page
+from ETFRecord import ETFRecord
+from HttpSession import shared_session
+from Metrics import shared_metrics
+from html import unescape
+import hashlib
 import pandas as pd
 import re
 import urllib.request
 import sys
 import json
-from jsonmerge import merge
 
 """
 Fetch single ETF data.
 Sources: etfdb.com, Etfdailynews.com and zacks.com.
 """
 class ETF:
-    def __init__(self, ticker):
+    # source -> page URL, formatted with the ticker
+    SOURCES = {
+        'etfdb': 'http://etfdb.com/etf/{}/',
+        'holdings': 'http://etfdailynews.com/tools/what-is-in-your-etf/?FundVariable={}',
+        'zacks': 'https://www.zacks.com/funds/etf/{}/holding',
+    }
+
+    # details key -> etfdb.com label; the value is the span following the label
+    DETAILS_LABELS = [
+        ('region_general', 'Region (General):'),
+        ('region_specific', 'Region (Specific):'),
+        ('bond_type', 'Bond Type(s):'),
+        ('bond_duration', 'Bond Duration:'),
+        ('asset_class_size', 'Asset Class Size:'),
+        ('asset_class_style', 'Asset Class Style:'),
+        ('currency', 'Currency:'),
+        ('commodity_type', 'Commodity Type:'),
+        ('commodity', 'Commodity:'),
+        ('commodity_exposure', 'Commodity Exposure:'),
+        ('sector_general', 'Sector (General):'),
+        ('sector_specific', 'Sector (Specific):'),
+    ]
+
+    # (h3 heading regex, dataframes key, column names); the first heading
+    # matching each regex is used, later specs overwrite earlier ones
+    TABLE_SPECS = [
+        (re.compile(r'Asset Allocation'),
+         'asset_allocation', ['category', 'allocation']),
+        (re.compile(r'Sector Breakdown'),
+         'sector_breakdown', ['sector', 'allocation']),
+        (re.compile(r'Bond Sector Breakdown'),
+         'sector_breakdown', ['sector', 'allocation']),
+        (re.compile(r'Bond Detailed Sector Breakdown'),
+         'bond_detailed_sector_breakdown', ['sector', 'allocation']),
+        (re.compile(r'Coupon Breakdown'),
+         'coupon_breakdown', ['coupon', 'allocation']),
+        (re.compile(r'Credit Quality'),
+         'credit_quality', ['rank', 'allocation']),
+        (re.compile(r'Maturity Breakdown'),
+         'maturity_breakdown', ['maturity', 'allocation']),
+        (re.compile(r'Market Cap Breakdown'),
+         'market_cap_breakdown', ['cap', 'allocation']),
+        (re.compile(r'Region Breakdown'),
+         'region_breakdown', ['ragion', 'allocation']),
+        (re.compile(r'Market Tier Breakdown'),
+         'market_tier_breakdown', ['tier', 'allocation']),
+        (re.compile(r'Country Breakdown'),
+         'country_breakdown', ['country', 'allocation']),
+    ]
+
+    # Zacks holdings are a JS array literal of rows of string cells
+    ZACKS_START = 'etf_holdings.formatted_data = [ [ '
+    ZACKS_END = ' ] ];'
+    ZACKS_TOKEN = re.compile(
+        r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'|(\]\s*,\s*\[)|([^\s,\[\]]+)', re.S)
+    ZACKS_ESCAPE = re.compile(r'\\(["\'\\])')
+    ZACKS_TOOLTIP = re.compile(r'onmouseover\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+    ZACKS_LINK = re.compile(r'<a\b[^>]*>(.*?)</a>', re.S)
+    TAG = re.compile(r'<[^>]*>')
+
+    def __init__(self, ticker, parser="html5lib", pages=None, lazy=False,
+                 fetcher=None, sources=None, metrics=None):
+        '''
+        parser: page backend, one of ETFPage.PARSERS.
+        pages: source -> raw page bytes to parse instead of downloading them
+        (see from_html).
+        lazy: only parse the etfdb summary fields now; the breakdown tables
+        are parsed and the holdings (with the Zacks fallback) are fetched on
+        first access to `dataframes` or `holdings`.
+        fetcher: object whose get(url) returns the raw page (and raises
+        urllib.error.HTTPError), defaults to the shared HttpSession.
+        sources: source -> URL template overriding SOURCES.
+        metrics: Metrics recording the time and outcome of every fetch,
+        parse and field, defaults to the shared one.
+        Raises urllib.error.HTTPError if the etfdb page cannot be fetched.
+        '''
         self.isValid = False
         self.ticker = ticker.upper()
         self.name = None
@@ -26,390 +101,249 @@ class ETF:
         self.asset_class = None
         self.category = None
         self.details = {}
-        self.dataframes = {}
-
-        url = 'http://etfdb.com/etf/' + self.ticker + "/"
-        try:
-            html = urllib.request.urlopen(url).read()
+        self.parser = parser
+        self._pages = pages
+        self._fetcher = fetcher
+        self.sources = sources if sources is not None else self.SOURCES
+        self._dataframes = {}
+        self._etfdb = None  # parsed etfdb page whose tables are not parsed yet
+        self._holdings_loaded = False
+        self.page_hashes = {}  # source -> sha1 of the raw page parsed, None if missing
+        self.metrics = metrics if metrics is not None else shared_metrics()
+        timed = self.metrics.time
+
+        try:
+            html = self.fetchPage('etfdb')
         except urllib.error.HTTPError as e:
             if (e.code == 404):
-                print(url + " not fund (404).")
-            sys.exit()
-        soup = bs(html, "html5lib")
+                print(self.sources['etfdb'].format(self.ticker) + " not fund (404).")
+            raise
+        with timed('soup', source='etfdb'):
+            page = parse_page(html, parser)
 
         # Name
         try:
-            self.name = soup.findAll("h1")[0].find_all("span")[
-                1].get_text().strip()
+            with timed('field', field='name'):
+                self.name = page.title()
         except:
             print("Error getting name for " + self.ticker)
 
-         # Expense Ratio
+        with timed('labels'):
+            labels = page.labels()
+
+        # Expense Ratio
         try:
-            raw = soup.findAll("span", text=re.compile(r'Expense Ratio'))[
-                0].findNext("span").get_text().strip()
-            self.expense_ratio = self.convert_percent(raw)
+            with timed('field', field='expense_ratio'):
+                raw = self.label_value(page, labels, 'Expense Ratio').strip()
+                self.expense_ratio = self.convert_percent(raw)
         except:
             print("Error getting Expense Ratio for " + self.ticker)
 
         # AUM
         try:
-            raw = soup.findAll("span", text=re.compile(r'AUM'))[
-                0].findNext("span").get_text().strip().replace(",", "")
-            self.aum = float(raw[1:-2])
-            mul = raw[-1]
-            if(mul == "B"):
-                self.aum = self.aum * 1000000000
-            elif(mul == "M"):
-                self.aum = self.aum * 1000000
+            with timed('field', field='aum'):
+                raw = self.label_value(page, labels, 'AUM').strip().replace(",", "")
+                self.aum = float(raw[1:-2])
+                mul = raw[-1]
+                if(mul == "B"):
+                    self.aum = self.aum * 1000000000
+                elif(mul == "M"):
+                    self.aum = self.aum * 1000000
         except:
             print("Error getting AUM for " + self.ticker)
 
         # Shares
         try:
-            raw = soup.findAll("span", text=re.compile(r'Shares:'))[
-                0].findNext("span").get_text().strip()
-            self.shares = float(raw[0:-2])
-            mul = raw[-1]
-            if(mul == "B"):
-                self.shares = int(
-                    self.shares * 1000000000)
-            elif(mul == "M"):
-                self.shares = int(self.shares * 1000000)
+            with timed('field', field='shares'):
+                raw = self.label_value(page, labels, 'Shares:').strip()
+                self.shares = float(raw[0:-2])
+                mul = raw[-1]
+                if(mul == "B"):
+                    self.shares = int(
+                        self.shares * 1000000000)
+                elif(mul == "M"):
+                    self.shares = int(self.shares * 1000000)
         except:
             print("Error getting Shares for " + self.ticker)
 
         # Underlying Index
         try:
-            self.index = soup.findAll("span", text=re.compile(r'Tracks This Index:'))[
-                0].findNext("span").get_text()
+            with timed('field', field='index'):
+                self.index = self.label_value(page, labels, 'Tracks This Index:')
         except:
             print("Error getting Underlying Index for " + self.ticker)
 
         # ETFdb.com Report
         try:
-            self.details['report'] = soup.find(
-                id="analyst-collapse").findNext("p").get_text()
+            with timed('field', field='report'):
+                self.details['report'] = page.report()
         except:
             pass
 
         # Category
         try:
-            self.category = soup.findAll("span", text=re.compile(r'ETFdb.com Category:'))[
-                0].findNext("span").get_text().strip()
+            with timed('field', field='category'):
+                self.category = self.label_value(
+                    page, labels, 'ETFdb.com Category:').strip()
         except:
             print("Error getting Asset class for " + self.ticker)
 
         # Asset Class
         try:
-            self.asset_class = soup.findAll("span", text=re.compile(r'Asset Class:'))[
-                0].findNext("span").get_text().strip()
+            with timed('field', field='asset_class'):
+                self.asset_class = self.label_value(page, labels, 'Asset Class:').strip()
         except:
             print("Error getting Asset class for " + self.ticker)
 
-        # Region (General)
-        try:
-            self.details['region_general'] = soup.findAll("span", text=re.compile(r'Region \(General\):'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Region (Specific)
-        try:
-            self.details['region_specific'] = soup.findAll("span", text=re.compile(r'Region \(Specific\):'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Bond Type(s)
-        try:
-            self.details['bond_type'] = soup.findAll("span", text=re.compile(r'Bond Type\(s\):'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Bond Duration
-        try:
-            self.details['bond_duration'] = soup.findAll("span", text=re.compile(r'Bond Duration:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Asset Class Size
-        try:
-            self.details['asset_class_size'] = soup.findAll("span", text=re.compile(r'Asset Class Size:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Asset Class Style
-        try:
-            self.details['asset_class_style'] = soup.findAll("span", text=re.compile(r'Asset Class Style:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Currency
-        try:
-            self.details['currency'] = soup.findAll("span", text=re.compile(r'Currency:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Commodity Type
-        try:
-            self.details['commodity_type'] = soup.findAll("span", text=re.compile(r'Commodity Type:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Commodity
-        try:
-            self.details['commodity'] = soup.findAll("span", text=re.compile(r'Commodity:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
-
-        # Commodity Exposure
-        try:
-            self.details['commodity_exposure'] = soup.findAll("span", text=re.compile(r'Commodity Exposure:'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
+        # Details (Region, Bond, Asset Class, Currency, Commodity, Sector)
+        for key, label in self.DETAILS_LABELS:
+            try:
+                with timed('field', field=key):
+                    self.details[key] = self.label_value(page, labels, label).strip()
+            except:
+                pass
 
-        # Sector (General)
-        try:
-            self.details['sector_general'] = soup.findAll("span", text=re.compile(r'Sector \(General\):'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
+        self._etfdb = page
+        if not lazy:
+            self._loadTables()
+            self._loadHoldings()
 
-        # Sector (Specific)
-        try:
-            self.details['sector_specific'] = soup.findAll("span", text=re.compile(r'Sector \(Specific\):'))[
-                0].findNext("span").get_text().strip()
-        except:
-            pass
+        self.isValid = True
 
+    @classmethod
+    def from_html(cls, ticker, etfdb, holdings=None, zacks=None, parser="html5lib", lazy=False,
+                  metrics=None):
+        '''
+        Build an ETF from already fetched pages (raw bytes) without any
+        network access. Missing holdings pages are simply skipped.
+        '''
+        pages = {'etfdb': etfdb, 'holdings': holdings, 'zacks': zacks}
+        return cls(ticker, parser=parser, pages=pages, lazy=lazy, metrics=metrics)
+
+    def toRecord(self):
+        '''
+        Compact ETFRecord of this ETF (loads the tables).
+        '''
+        return ETFRecord.from_frames(
+            self.dataframes, ticker=self.ticker, name=self.name,
+            expense_ratio=self.expense_ratio, aum=self.aum, shares=self.shares,
+            index=self.index, asset_class=self.asset_class, category=self.category,
+            details=self.details)
+
+    @classmethod
+    def fromRecord(cls, record):
+        '''
+        ETF rebuilt from an ETFRecord, without any page or network access.
+        '''
+        etf = cls.__new__(cls)
+        etf.ticker = record.ticker
+        for field in ('name', 'expense_ratio', 'aum', 'shares', 'index',
+                      'asset_class', 'category'):
+            setattr(etf, field, getattr(record, field))
+        etf.details = dict(record.details)
+        etf.parser = None
+        etf._pages = None
+        etf._fetcher = None
+        etf.sources = cls.SOURCES
+        etf._dataframes = record.frames()
+        etf._etfdb = None
+        etf._holdings_loaded = True
+        etf.page_hashes = {}
+        etf.metrics = shared_metrics()
+        etf.isValid = True
+        return etf
+
+    def fetchPage(self, source):
+        '''
+        Raw page of a source, None if it was not given to from_html.
+        Downloads are timed as the "fetch" phase of the source. Every
+        source asked for gets a page_hashes entry, None if the page is
+        missing (not given, or the download failed).
+        '''
+        self.page_hashes[source] = None
+        if self._pages is not None:
+            html = self._pages.get(source)
+        else:
+            url = self.sources[source].format(self.ticker)
+            with self.metrics.time('fetch', source=source):
+                if self._fetcher is not None:
+                    html = self._fetcher.get(url)
+                else:
+                    html = shared_session().get(url)
+        if html is not None:
+            self.page_hashes[source] = hashlib.sha1(html).hexdigest()
+        return html
+
+    @property
+    def dataframes(self):
+        if self._etfdb is not None:
+            self._loadTables()
+        if not self._holdings_loaded:
+            self._loadHoldings()
+        return self._dataframes
+
+    @property
+    def holdings(self):
+        if not self._holdings_loaded:
+            self._loadHoldings()
+        return self._dataframes.get('holdings')
+
+    def _loadTables(self):
         # Graphs
-        # Asset Allocation
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Asset Allocation'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['asset_allocation'] = pd.read_html(table)[0]
-            self.dataframes['asset_allocation'].columns = [
-                'category', 'allocation']
-            self.dataframes['asset_allocation']['allocation'] = self.dataframes['asset_allocation'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Sector Breakdown | Bond Sector Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(r'Sector Breakdown'))[
-                0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['sector_breakdown'] = pd.read_html(table)[0]
-            self.dataframes['sector_breakdown'].columns = [
-                'sector', 'allocation']
-            self.dataframes['sector_breakdown']['allocation'] = self.dataframes['sector_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Bond Sector Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(r'Bond Sector Breakdown'))[
-                0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['sector_breakdown'] = pd.read_html(table)[0]
-            self.dataframes['sector_breakdown'].columns = [
-                'sector', 'allocation']
-            self.dataframes['sector_breakdown']['allocation'] = self.dataframes['sector_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Bond Detailed Sector Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Bond Detailed Sector Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['bond_detailed_sector_breakdown'] = pd.read_html(table)[
-                0]
-            self.dataframes['bond_detailed_sector_breakdown'].columns = [
-                'sector', 'allocation']
-            self.dataframes['bond_detailed_sector_breakdown']['allocation'] = self.dataframes['bond_detailed_sector_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Coupon Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Coupon Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['coupon_breakdown'] = pd.read_html(table)[0]
-            self.dataframes['coupon_breakdown'].columns = [
-                'coupon', 'allocation']
-            self.dataframes['coupon_breakdown']['allocation'] = self.dataframes['coupon_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Credit Quality
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Credit Quality'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['credit_quality'] = pd.read_html(table)[0]
-            self.dataframes['credit_quality'].columns = [
-                'rank', 'allocation']
-            self.dataframes['credit_quality']['allocation'] = self.dataframes['credit_quality'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Maturity Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Maturity Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['maturity_breakdown'] = pd.read_html(table)[0]
-            self.dataframes['maturity_breakdown'].columns = [
-                'maturity', 'allocation']
-            self.dataframes['maturity_breakdown']['allocation'] = self.dataframes['maturity_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Market Cap Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Market Cap Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['market_cap_breakdown'] = pd.read_html(table)[0]
-            self.dataframes['market_cap_breakdown'].columns = [
-                'cap', 'allocation']
-            self.dataframes['market_cap_breakdown']['allocation'] = self.dataframes['market_cap_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Region Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Region Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['region_breakdown'] = pd.read_html(
-                table)[0]
-            self.dataframes['region_breakdown'].columns = [
-                'ragion', 'allocation']
-            self.dataframes['region_breakdown']['allocation'] = self.dataframes['region_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        # Market Tier Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Market Tier Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['market_tier_breakdown'] = pd.read_html(
-                table)[0]
-            self.dataframes['market_tier_breakdown'].columns = [
-                'tier', 'allocation']
-            self.dataframes['market_tier_breakdown']['allocation'] = self.dataframes['market_tier_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
+        holdings = self._dataframes.pop('holdings', None)
+        with self.metrics.time('headings'):
+            headings = self.find_headings(self._etfdb.headings(), self.TABLE_SPECS)
+        for (regex, key, columns), h3 in zip(self.TABLE_SPECS, headings):
+            if h3 is None:
+                continue
+            try:
+                with self.metrics.time('table', table=key):
+                    self._dataframes[key] = self.table_frame(
+                        self._etfdb.table_after(h3), columns)
+            except:
+                pass
+        if holdings is not None:  # keep holdings last, as in eager mode
+            self._dataframes['holdings'] = holdings
+        self._etfdb = None
 
-        # Country Breakdown
-        try:
-            tbody = soup.findAll("h3", text=re.compile(
-                r'Country Breakdown'))[0].findNext("table").tbody
-            table = "<table>" + \
-                str(tbody).lstrip(
-                    "<tbody>").rstrip("</tbody>") + "</table>"
-            self.dataframes['country_breakdown'] = pd.read_html(
-                table)[0]
-            self.dataframes['country_breakdown'].columns = [
-                'country', 'allocation']
-            self.dataframes['country_breakdown']['allocation'] = self.dataframes['country_breakdown'].allocation.map(
-                lambda x: self.convert_percent(x))
-        except:
-            pass
+    def _loadHoldings(self):
+        self._holdings_loaded = True
 
         # Holdings
         try:
-            url = 'http://etfdailynews.com/tools/what-is-in-your-etf/?FundVariable=' + self.ticker
-            html = urllib.request.urlopen(
-                url).read().decode('cp1252').encode('utf-8')
-            soup = bs(html, "html5lib")
-            holdings_raw_table = soup.find(id="etfs-that-own")
-            if(holdings_raw_table != None):
-                holdings_tbody = holdings_raw_table.tbody
-                holdings_table = "<table>" + \
-                    str(holdings_tbody).lstrip("<tbody>").rstrip(
-                        "</tbody>") + "</table>"
-                self.dataframes['holdings'] = pd.read_html(holdings_table)[0]
-                self.dataframes['holdings'].columns = [
-                    'ticker', 'name', 'allocation']
-                self.dataframes['holdings']['allocation'] = self.dataframes['holdings'].allocation.map(
-                    lambda x: self.convert_percent(x))
-        except:
-            pass
-
-        if('holdings' is not self.details.keys()):  # let's try with zacks.com
+            html = self.fetchPage('holdings')
+            if html is not None:
+                with self.metrics.time('soup', source='holdings'):
+                    page = parse_page(html.decode('cp1252').encode('utf-8'), self.parser)
+                with self.metrics.time('table', table='holdings'):
+                    rows = page.table_by_id("etfs-that-own")
+                    if(rows != None):
+                        self._dataframes['holdings'] = self.table_frame(
+                            rows, ['ticker', 'name', 'allocation'])
+                self.metrics.count('holdings', "ok" if rows is not None else "missing",
+                                   source='holdings')
+        except:
+            self.metrics.count('holdings', "error", source='holdings')
+
+        if 'holdings' not in self._dataframes:  # let's try with zacks.com
             '''
-            Slower (since data is parsed from string) and less reliable data.
+            Less reliable data, only used when etfdailynews has no holdings.
             '''
             try:
-                url = 'https://www.zacks.com/funds/etf/' + ticker + '/holding'
-                html = urllib.request.urlopen(url).read().decode('cp1252')
-                str_start, str_end = html.find(
-                    'etf_holdings.formatted_data = [ [ '), html.find(' ] ];')
-                if str_start == -1 or str_end == -1:
+                html = self.fetchPage('zacks')
+                if html is None:
+                    return
+                with self.metrics.time('zacks'):
+                    holdings = self.zacks_holdings(html.decode('cp1252'))
+                if holdings is None:
                     # If Zacks does not have data for the given ETF
-                    print("Could not fetch data for {}".format(ticker))
+                    self.metrics.count('holdings', "missing", source='zacks')
+                    print("Could not fetch data for {}".format(self.ticker))
                 else:
-                    list_str = "[[" + html[(str_start + 34):str_end] + "]]"
-                    holdings_list = ast.literal_eval(list_str)
-                    self.dataframes['holdings'] = pd.DataFrame(holdings_list).drop(
-                        2, 1).drop(4, 1).drop(5, 1)
-                    self.dataframes['holdings'].columns = [
-                        'name', 'ticker', 'allocation']
-                    self.dataframes['holdings']['allocation'] = self.dataframes['holdings'].allocation.map(
-                        lambda x: self.zacks_clean_allocation(x))
-                    self.dataframes['holdings']['name'] = self.dataframes['holdings'].name.map(
-                        lambda x: self.zacks_clean_name(x))
-                    self.dataframes['holdings']['ticker'] = self.dataframes['holdings'].ticker.map(
-                        lambda x: self.zacks_clean_ticker(x))
+                    self.metrics.count('holdings', "ok", source='zacks')
+                    self._dataframes['holdings'] = holdings
             except:
-                pass
-
-        self.isValid = True
+                self.metrics.count('holdings', "error", source='zacks')
 
     def __getitem__(self, key):
         if key in self.details.keys():
@@ -417,23 +351,109 @@ class ETF:
         else:
             return None
 
+    @staticmethod
+    def label_value(page, labels, label):
+        '''
+        Text of the span following `label` in the page label index. An exact
+        label match wins, otherwise the first label containing `label` is
+        used. Raises KeyError if the page has no such label.
+        '''
+        span = labels.get(label)
+        if span is None:
+            span = next(
+                (labels[text] for text in labels if label in text), None)
+            if span is None:
+                raise KeyError(label)
+        return page.text(span)
+
+    @staticmethod
+    def find_headings(headings, specs):
+        '''
+        Walk the page h3 headings once and return, for each spec, the first
+        heading matching its regex (None if the page has none).
+        '''
+        found = [None] * len(specs)
+        for text, h3 in headings:
+            for i, spec in enumerate(specs):
+                if found[i] is None and spec[0].search(text):
+                    found[i] = h3
+        return found
+
+    @staticmethod
+    def table_frame(rows, columns):
+        '''
+        Build a DataFrame straight from the cells of an already parsed table.
+        The last column holds percentages and is converted to floats.
+        '''
+        df = pd.DataFrame(rows, columns=columns)
+        allocation = columns[-1]
+        df[allocation] = pd.to_numeric(
+            df[allocation].str.rstrip('%')) / 100
+        return df
+
     @staticmethod
     def convert_percent(pct):
         if type(pct) == float:
             return pct / 100
         return float(pct.rstrip('%')) / 100
 
-    @staticmethod
-    def zacks_clean_name(str_input):
+    @classmethod
+    def zacks_holdings(cls, html):
+        '''
+        Holdings (name, ticker, allocation) from the Zacks page, scanning the
+        embedded JS literal once with precompiled patterns. None if the page
+        has no holdings data.
+        '''
+        str_start, str_end = html.find(cls.ZACKS_START), html.find(cls.ZACKS_END)
+        if str_start == -1 or str_end == -1:
+            return None
+        names, tickers, allocations = [], [], []
+        row = []
+        for match in cls.ZACKS_TOKEN.finditer(html, str_start + len(cls.ZACKS_START), str_end):
+            double, single, separator, bare = match.groups()
+            if separator is None:
+                value = double if double is not None else single if single is not None else bare
+                row.append(cls.ZACKS_ESCAPE.sub(r'\1', value))
+                continue
+            if len(row) > 3:
+                names.append(cls.zacks_clean_name(row[0]))
+                tickers.append(cls.zacks_clean_ticker(row[1]))
+                allocations.append(row[3])
+            row = []
+        if len(row) > 3:
+            names.append(cls.zacks_clean_name(row[0]))
+            tickers.append(cls.zacks_clean_ticker(row[1]))
+            allocations.append(row[3])
+        holdings = pd.DataFrame({'name': names, 'ticker': tickers,
+                                 'allocation': allocations})
+        holdings['allocation'] = pd.to_numeric(
+            holdings.allocation.replace("NA", "0")) / 100
+        return holdings
+
+    @classmethod
+    def zacks_clean_name(cls, str_input):
+        '''
+        Full name from the tooltip of a "<span onmouseover=...>" cell.
+        '''
         if "<span" in str_input:
-            soup = bs(str_input, "lxml")
-            return soup.find('span')['onmouseover'].lstrip("tooltip.show('").rstrip(".');")
+            match = cls.ZACKS_TOOLTIP.search(str_input)
+            tooltip = unescape(match.group(1) if match.group(1) is not None else match.group(2))
+            if tooltip.startswith("tooltip.show('"):
+                tooltip = tooltip[len("tooltip.show('"):]
+            if tooltip.endswith("');"):
+                tooltip = tooltip[:-len("');")]
+            return tooltip
         return str_input
 
-    @staticmethod
-    def zacks_clean_ticker(str_input):
-        soup = bs(str_input, "lxml")
-        return soup.find('a').text
+    @classmethod
+    def zacks_clean_ticker(cls, str_input):
+        '''
+        Text of the "<a>" link of a ticker cell.
+        '''
+        match = cls.ZACKS_LINK.search(str_input)
+        if match is not None:
+            str_input = match.group(1)
+        return unescape(cls.TAG.sub('', str_input))
 
     @staticmethod
     def zacks_clean_allocation(str_input):
@@ -473,8 +493,8 @@ class ETF:
     class JsonEncoder(json.JSONEncoder):
 
         def default(self, obj):
-            if hasattr(obj, 'to_json'):
-                return obj.to_json(orient='records', force_ascii=False),
+            if hasattr(obj, 'to_dict'):  # tables as lists of records, NaN as null
+                return obj.astype(object).where(obj.notna(), None).to_dict(orient='records')
             return json.JSONEncoder.default(self, obj)
 
     def dataframesToDict(self):
@@ -511,10 +531,10 @@ class ETF:
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python " + sys.argv[0] + " ticker")
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] not in PARSERS):
+        print("Usage: python " + sys.argv[0] + " ticker [" + "|".join(PARSERS) + "]")
         sys.exit(1)
 
     print("Downloading ETF details (" + sys.argv[1] + ")...")
-    etf = ETF(sys.argv[1])
+    etf = ETF(sys.argv[1], *sys.argv[2:])
     etf.printSummary()
@@ -0,0 +1,126 @@
+import json
+import pandas as pd
+import sys
+import threading
+
+"""
+Streaming NDJSON export of ETFs: one JSON document per line, written as the
+ETFs are produced, so a full dump never has to sit in memory.
+Tables are serialized column-wise, {"column": [values, ...]}, straight from
+the DataFrame columns without building a dict per row.
+"""
+
+FIELDS = ('ticker', 'name', 'category', 'asset_class', 'expense_ratio', 'aum',
+          'shares', 'index', 'details')
+
+
+def column_values(series):
+    '''
+    Values of a column as a list, NaN as None (null).
+    '''
+    if series.hasnans:
+        series = series.astype(object).where(series.notna(), None)
+    return series.tolist()
+
+
+def table_columns(table):
+    '''
+    {column: values} of a DataFrame, or of a toDict() table (list of records).
+    '''
+    if isinstance(table, pd.DataFrame):
+        return {str(column): column_values(table[column]) for column in table.columns}
+    if isinstance(table, dict):  # already column-wise
+        return table
+    columns = list(table[0]) if table else []
+    return {column: [row.get(column) for row in table] for column in columns}
+
+
+def etf_columns(etf):
+    '''
+    Exported document of an ETF object or of a toDict() document.
+    '''
+    if isinstance(etf, dict):
+        doc = {key: value for key, value in etf.items() if key != 'tables'}
+        tables = etf.get('tables', {})
+    else:
+        doc = {field: getattr(etf, field) for field in FIELDS}
+        tables = etf.dataframes
+    doc['tables'] = {key: table_columns(table) for key, table in tables.items()}
+    return doc
+
+
+def etf_line(etf):
+    return json.dumps(etf_columns(etf), ensure_ascii=False, default=str) + '\n'
+
+
+class NDJSONWriter:
+    def __init__(self, target, flush_every=1):
+        '''
+        target: file path ('-' for stdout), or any object with write(str),
+        e.g. a socket's makefile('w').
+        flush_every: lines between flushes, so readers at the other end of a
+        pipe or socket see the ETFs as they are produced.
+        '''
+        if isinstance(target, str):
+            self.file = sys.stdout if target == '-' else open(target, 'w', encoding='utf-8')
+            self._owned = target != '-'
+        else:
+            self.file = target
+            self._owned = False
+        self.flush_every = flush_every
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, etf):
+        '''
+        Write one ETF (object or toDict() document) as a line.
+        Safe to call from several threads.
+        '''
+        line = etf_line(etf)
+        with self._lock:
+            self.file.write(line)
+            self.count += 1
+            if self.flush_every and self.count % self.flush_every == 0 and hasattr(self.file, 'flush'):
+                self.file.flush()
+
+    def close(self):
+        if self._owned:
+            self.file.close()
+        elif hasattr(self.file, 'flush'):
+            self.file.flush()
+
+
+def read_ndjson(source, tables="columns"):
+    '''
+    Generator over the ETF documents of an NDJSON export, one line at a time.
+    source: file path ('-' for stdin) or an iterable of lines (file, socket
+    makefile()).
+    tables: "columns" keeps {column: values}, "frames" gives DataFrames and
+    "records" lists of row dicts, as in toDict().
+    '''
+    if isinstance(source, str):
+        if source == '-':
+            yield from read_ndjson(sys.stdin, tables)
+            return
+        with open(source, encoding='utf-8') as lines:
+            yield from read_ndjson(lines, tables)
+        return
+    for line in source:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        doc = json.loads(line)
+        if tables == "frames":
+            doc['tables'] = {key: pd.DataFrame(columns)
+                             for key, columns in doc['tables'].items()}
+        elif tables == "records":
+            doc['tables'] = {key: [dict(zip(columns, row)) for row in zip(*columns.values())]
+                             for key, columns in doc['tables'].items()}
+        yield doc
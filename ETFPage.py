@@ -0,0 +1,165 @@
+from bs4 import BeautifulSoup as bs
+from bs4.dammit import UnicodeDammit
+import lxml.html
+
+"""
+Parsed page backends used by ETF.
+"html5lib" and "lxml" build a BeautifulSoup tree with that builder,
+"lxml.html" walks the lxml tree directly and skips BeautifulSoup entirely.
+All backends expose the same lookups, so ETF extraction does not depend on
+the backend in use.
+"""
+
+PARSERS = ("html5lib", "lxml", "lxml.html")
+
+
+def parse_page(html, parser="html5lib"):
+    if parser == "lxml.html":
+        return LxmlPage(html)
+    if parser in ("html5lib", "lxml"):
+        return SoupPage(html, parser)
+    raise ValueError("Unknown parser " + str(parser) +
+                     ", expected one of " + str(PARSERS))
+
+
+def clean_text(text):
+    return " ".join(text.split())
+
+
+class SoupPage:
+    def __init__(self, html, parser):
+        self.soup = bs(html, parser)
+
+    def title(self):
+        '''
+        Text of the second span of the first h1.
+        '''
+        return self.soup.findAll("h1")[0].find_all("span")[1].get_text().strip()
+
+    def labels(self):
+        '''
+        Map each span string to the span that follows it in document order
+        (first occurrence wins, insertion order is document order).
+        '''
+        labels = {}
+        spans = self.soup.find_all("span")
+        for i in range(len(spans) - 1):
+            text = spans[i].string
+            if text is not None and text not in labels:
+                labels[text] = spans[i + 1]
+        return labels
+
+    def text(self, node):
+        return node.get_text()
+
+    def report(self):
+        return self.soup.find(id="analyst-collapse").findNext("p").get_text()
+
+    def headings(self):
+        '''
+        (string, node) of every h3 with a single string, in document order.
+        '''
+        return [(h3.string, h3) for h3 in self.soup.find_all("h3")
+                if h3.string is not None]
+
+    def table_after(self, node):
+        return self.rows(node.findNext("table"))
+
+    def table_by_id(self, id):
+        table = self.soup.find(id=id)
+        if table is None:
+            return None
+        return self.rows(table)
+
+    @staticmethod
+    def rows(table):
+        '''
+        Cell texts of the table body rows. html5lib always inserts a tbody,
+        lxml does not, so without one the rows outside thead/tfoot are used.
+        '''
+        tbody = table.tbody
+        if tbody is not None:
+            trs = tbody.find_all("tr")
+        else:
+            trs = [tr for tr in table.find_all("tr")
+                   if tr.find_parent(["thead", "tfoot"]) is None]
+        return [[clean_text(cell.get_text()) for cell in tr.find_all(["td", "th"])]
+                for tr in trs]
+
+
+class LxmlPage:
+    def __init__(self, html):
+        if isinstance(html, bytes):
+            # same encoding detection BeautifulSoup applies to raw bytes
+            html = UnicodeDammit(html, is_html=True).unicode_markup
+        self.doc = lxml.html.document_fromstring(html)
+
+    def title(self):
+        h1 = next(self.doc.iter("h1"))
+        return list(h1.iter("span"))[1].text_content().strip()
+
+    def labels(self):
+        labels = {}
+        spans = list(self.doc.iter("span"))
+        for i in range(len(spans) - 1):
+            text = self.string(spans[i])
+            if text is not None and text not in labels:
+                labels[text] = spans[i + 1]
+        return labels
+
+    def text(self, node):
+        return node.text_content()
+
+    def report(self):
+        node = self.doc.get_element_by_id("analyst-collapse")
+        return self.next_element(node, "p").text_content()
+
+    def headings(self):
+        headings = []
+        for h3 in self.doc.iter("h3"):
+            text = self.string(h3)
+            if text is not None:
+                headings.append((text, h3))
+        return headings
+
+    def table_after(self, node):
+        return self.rows(self.next_element(node, "table"))
+
+    def table_by_id(self, id):
+        table = self.doc.get_element_by_id(id, None)
+        if table is None:
+            return None
+        return self.rows(table)
+
+    @staticmethod
+    def rows(table):
+        tbody = table.find(".//tbody")
+        if tbody is not None:
+            trs = tbody.iter("tr")
+        else:
+            trs = table.xpath(".//tr[not(ancestor::thead) and not(ancestor::tfoot)]")
+        return [[clean_text(cell.text_content()) for cell in tr.iter("td", "th")]
+                for tr in trs]
+
+    @staticmethod
+    def next_element(node, tag):
+        '''
+        First `tag` element after the start of `node`, as findNext() does.
+        '''
+        found = node.xpath("(descendant::%s | following::%s)[1]" % (tag, tag))
+        if not found:
+            raise LookupError("No " + tag + " after " + node.tag)
+        return found[0]
+
+    @staticmethod
+    def string(node):
+        '''
+        Same as BeautifulSoup's Tag.string: the text of a node that has a
+        single child, descending through single-child elements.
+        '''
+        while True:
+            if len(node) == 0:
+                return node.text
+            if len(node) > 1 or node.text or node[0].tail:
+                return None
+            node = node[0]
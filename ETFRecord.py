@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+import sys
+
+"""
+Compact in-memory representation of ETFs for long-running services.
+ETFRecord keeps the scalar fields in __slots__, with interned strings, and
+every table as a tuple of NumPy arrays (one per column) instead of a
+DataFrame. Universe holds thousands of records with the scalar fields laid
+out as arrays (struct of arrays), so filters over the whole universe are
+vectorized.
+"""
+
+SCALAR_FIELDS = ('ticker', 'name', 'expense_ratio', 'aum', 'shares', 'index',
+                 'asset_class', 'category')
+
+# column name tuples shared by all records
+_columns = {}
+
+
+def intern(value):
+    '''
+    sys.intern for strings, other values unchanged.
+    '''
+    return sys.intern(value) if type(value) is str else value
+
+
+def _intern_columns(columns):
+    columns = tuple(sys.intern(str(column)) for column in columns)
+    return _columns.setdefault(columns, columns)
+
+
+def label_array(values):
+    '''
+    Object array of interned labels (tickers, sectors, countries, ...).
+    '''
+    array = np.empty(len(values), dtype=object)
+    array[:] = [intern(value) for value in values]
+    return array
+
+
+class ETFRecord:
+    __slots__ = SCALAR_FIELDS + ('details', 'tables')
+
+    def __init__(self, ticker, name=None, expense_ratio=None, aum=None, shares=None,
+                 index=None, asset_class=None, category=None, details=None, tables=None):
+        '''
+        details: tuple of (key, value) pairs.
+        tables: key -> (columns, arrays), the last array being the float
+        allocations and the others interned labels.
+        '''
+        self.ticker = intern(ticker)
+        self.name = name
+        self.expense_ratio = expense_ratio
+        self.aum = aum
+        self.shares = shares
+        self.index = intern(index)
+        self.asset_class = intern(asset_class)
+        self.category = intern(category)
+        self.details = details or ()
+        self.tables = tables or {}
+
+    @classmethod
+    def from_frames(cls, dataframes, **fields):
+        '''
+        Record from ETF-style fields and a dict of DataFrames.
+        '''
+        tables = {}
+        for key, frame in dataframes.items():
+            arrays = [label_array(frame[column].tolist()) for column in frame.columns[:-1]]
+            arrays.append(frame[frame.columns[-1]].to_numpy(dtype=np.float64))
+            tables[intern(key)] = (_intern_columns(frame.columns), tuple(arrays))
+        details = tuple((intern(key), intern(value))
+                        for key, value in (fields.pop('details', None) or {}).items())
+        return cls(details=details, tables=tables, **fields)
+
+    def frames(self):
+        '''
+        Tables back as DataFrames, as in ETF.dataframes.
+        '''
+        return {key: pd.DataFrame(dict(zip(columns, arrays)))
+                for key, (columns, arrays) in self.tables.items()}
+
+    def table(self, key):
+        '''
+        (labels, allocations) arrays of a table, (None, None) if missing.
+        For holdings the labels are the holding tickers.
+        '''
+        if key not in self.tables:
+            return None, None
+        columns, arrays = self.tables[key]
+        label = columns.index('ticker') if 'ticker' in columns[:-1] else 0
+        return arrays[label], arrays[-1]
+
+    def nbytes(self):
+        '''
+        Approximate memory of the record: the object, its arrays and the
+        strings it does not share with other records.
+        '''
+        size = sys.getsizeof(self) + sys.getsizeof(self.details) + sys.getsizeof(self.tables)
+        for columns, arrays in self.tables.values():
+            size += sys.getsizeof(arrays)
+            for array in arrays:
+                size += array.nbytes + sys.getsizeof(array)
+        for name in ('name', 'expense_ratio', 'aum', 'shares'):
+            size += sys.getsizeof(getattr(self, name))
+        return size
+
+    def __repr__(self):
+        return "ETFRecord({!r}, {} tables)".format(self.ticker, len(self.tables))
+
+
+class Universe:
+    def __init__(self, records=()):
+        '''
+        Struct-of-arrays container of ETFRecords. The scalar fields are kept
+        as NumPy arrays (asset_class and category as codes into a shared
+        list of labels), rebuilt lazily after records are added.
+        '''
+        self.records = []
+        self._positions = {}
+        self._arrays = None
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        '''
+        Add or replace (same ticker) a record.
+        '''
+        position = self._positions.get(record.ticker)
+        if position is None:
+            self._positions[record.ticker] = len(self.records)
+            self.records.append(record)
+        else:
+            self.records[position] = record
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, ticker):
+        return ticker in self._positions
+
+    def __getitem__(self, ticker):
+        return self.records[self._positions[ticker]]
+
+    def _build(self):
+        records = self.records
+        arrays = {'ticker': label_array([record.ticker for record in records])}
+        for name in ('expense_ratio', 'aum', 'shares'):
+            arrays[name] = np.array([getattr(record, name) if isinstance(getattr(record, name), (int, float))
+                                     else np.nan for record in records], dtype=np.float64)
+        for name in ('asset_class', 'category'):
+            labels, codes = np.unique(np.array([getattr(record, name) or '' for record in records],
+                                               dtype=object), return_inverse=True)
+            arrays[name] = codes.astype(np.int32)
+            arrays[name + '_labels'] = [intern(label) for label in labels]
+        self._arrays = arrays
+        return arrays
+
+    @property
+    def arrays(self):
+        '''
+        Column arrays of the scalar fields.
+        '''
+        return self._arrays if self._arrays is not None else self._build()
+
+    def column(self, name):
+        '''
+        One scalar field for the whole universe, labels decoded.
+        '''
+        arrays = self.arrays
+        if name + '_labels' in arrays:
+            return np.array(arrays[name + '_labels'], dtype=object)[arrays[name]]
+        return arrays[name]
+
+    def mask(self, asset_class=None, category=None, min_aum=None, max_expense_ratio=None):
+        '''
+        Boolean array of the records matching every given condition;
+        asset_class and category can be a label or a list of labels.
+        '''
+        arrays = self.arrays
+        mask = np.ones(len(self.records), dtype=bool)
+        for name, wanted in (('asset_class', asset_class), ('category', category)):
+            if wanted is None:
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            codes = [code for code, label in enumerate(arrays[name + '_labels']) if label in wanted]
+            if len(codes) == 1:
+                mask &= arrays[name] == codes[0]
+            else:
+                mask &= np.isin(arrays[name], codes)
+        if min_aum is not None:
+            mask &= arrays['aum'] >= min_aum
+        if max_expense_ratio is not None:
+            mask &= arrays['expense_ratio'] <= max_expense_ratio
+        return mask
+
+    def filter(self, **conditions):
+        '''
+        Tickers of the records matching mask(**conditions).
+        '''
+        return self.arrays['ticker'][self.mask(**conditions)].tolist()
+
+    def nbytes(self):
+        arrays = self.arrays
+        return (sum(record.nbytes() for record in self.records) +
+                sum(array.nbytes for array in arrays.values() if isinstance(array, np.ndarray)))
+
+
+if __name__ == "__main__":
+    from ETF import ETF
+    from ParserCheck import load_pages
+    import contextlib
+    import gc
+    import io
+    import os
+    import time
+    import tracemalloc
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python " + sys.argv[0] + " corpus_dir [copies]")
+        sys.exit(1)
+    corpus = sys.argv[1]
+    copies = int(sys.argv[2]) if len(sys.argv) == 3 else 100
+    tickers = sorted(ticker for ticker in os.listdir(corpus)
+                     if os.path.isfile(os.path.join(corpus, ticker, "etfdb.html")))
+    pages = {ticker: load_pages(os.path.join(corpus, ticker)) for ticker in tickers}
+
+    # memory retained by `copies` copies of every corpus ETF, as objects and as records
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    etfs = []
+    for copy in range(copies):
+        for ticker in tickers:
+            with contextlib.redirect_stdout(io.StringIO()):  # missing field messages
+                etf = ETF.from_html(ticker, parser="lxml.html", **pages[ticker])
+            etf.dataframes
+            etf._pages = None  # as if downloaded: the raw pages are not kept
+            etf.ticker = "{}{}".format(ticker, copy)
+            etfs.append(etf)
+    gc.collect()
+    etf_bytes = tracemalloc.get_traced_memory()[0] - base
+    universe = Universe(etf.toRecord() for etf in etfs)
+    universe.arrays
+    del etfs, etf
+    gc.collect()
+    record_bytes = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    count = len(universe)
+    print("{} funds: ETF {:.1f} KB/fund, ETFRecord {:.1f} KB/fund ({:.1f}x smaller)".format(
+        count, etf_bytes / count / 1024, record_bytes / count / 1024, etf_bytes / record_bytes))
+
+    # bulk filter: equity funds over $1B, expense ratio at most 0.2%
+    etfs = [ETF.fromRecord(record) for record in universe]
+    asset_class = universe.records[0].asset_class
+    repeat = 20
+    start = time.perf_counter()
+    for _ in range(repeat):
+        slow = [etf.ticker for etf in etfs
+                if etf.asset_class == asset_class and etf.aum is not None and etf.aum >= 1e9
+                and etf.expense_ratio is not None and etf.expense_ratio <= 0.002]
+    objects = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fast = universe.filter(asset_class=asset_class, min_aum=1e9, max_expense_ratio=0.002)
+    arrays = (time.perf_counter() - start) / repeat
+    assert fast == slow
+    print("filter over {} funds: ETF objects {:.3f} ms, Universe {:.3f} ms ({:.1f}x faster)".format(
+        count, objects * 1000, arrays * 1000, objects / arrays))
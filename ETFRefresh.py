@@ -0,0 +1,107 @@
+from PageCache import DAY
+import datetime
+import hashlib
+import heapq
+import json
+import math
+
+"""
+Incremental refresh bookkeeping for the ETF documents in MongoDB.
+Each document carries a `_refresh` entry with when each source page was
+last fetched and its content hash, plus the hash of the whole toDict()
+output. Documents are due once a field group is older than its TTL and are
+refreshed stalest and largest (by AUM) first.
+"""
+
+# field group -> sources its fields are parsed from
+GROUPS = {
+    'profile': ('etfdb',),
+    'holdings': ('holdings', 'zacks'),
+}
+
+# field group -> seconds before it is due for a refresh
+GROUP_TTLS = {
+    'profile': 7 * DAY,
+    'holdings': DAY,
+}
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def content_hash(doc):
+    '''
+    Stable hash of an ETF document (toDict() output).
+    '''
+    data = json.dumps(doc, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def refresh_meta(page_hashes, doc_hash, fetched_at=None):
+    '''
+    `_refresh` entry of a freshly parsed ETF, from its page_hashes. Sources
+    tried without a page (hash None) are recorded too, so missing data is
+    retried once its TTL is over, not on every refresh.
+    '''
+    fetched_at = fetched_at or now()
+    return {
+        'fetched_at': fetched_at,
+        'hash': doc_hash,
+        'sources': {source: {'fetched_at': fetched_at, 'hash': page_hash}
+                    for source, page_hash in page_hashes.items()},
+    }
+
+
+class RefreshScheduler:
+    def __init__(self, collection, ttls=None):
+        '''
+        ttls: field group -> seconds, defaults to GROUP_TTLS.
+        '''
+        self.collection = collection
+        self.ttls = ttls if ttls is not None else GROUP_TTLS
+        self.hashes = {}  # ticker -> stored toDict() hash
+
+    def staleness(self, meta, at):
+        '''
+        Largest age / TTL ratio over the field groups (inf if never fetched).
+        '''
+        sources = (meta or {}).get('sources', {})
+        ratio = 0
+        for group, group_sources in GROUPS.items():
+            fetched = [sources[source]['fetched_at'] for source in group_sources
+                       if source in sources]
+            if not fetched:
+                return math.inf
+            latest = max(fetched)
+            if latest.tzinfo is None:  # pymongo returns naive UTC datetimes
+                latest = latest.replace(tzinfo=datetime.timezone.utc)
+            ratio = max(ratio, (at - latest).total_seconds() / self.ttls[group])
+        return ratio
+
+    def due(self, tickers, at=None):
+        '''
+        Tickers that need a refresh, highest priority first: tickers never
+        fetched, then by staleness weighted by log AUM. Also remembers the
+        stored document hashes for changed().
+        '''
+        at = at or now()
+        docs = {doc['ticker']: doc for doc in self.collection.find(
+            {'ticker': {'$in': list(tickers)}},
+            {'ticker': True, 'aum': True, '_refresh': True, '_id': False})}
+        heap = []
+        for ticker in tickers:
+            doc = docs.get(ticker, {})
+            meta = doc.get('_refresh')
+            if meta is not None:
+                self.hashes[ticker] = meta.get('hash')
+            ratio = self.staleness(meta, at)
+            if ratio < 1:
+                continue
+            aum = doc.get('aum') or 0
+            priority = ratio * math.log10(10 + aum / 1e6)
+            heapq.heappush(heap, (-priority, ticker))
+        return [heapq.heappop(heap)[1] for _ in range(len(heap))]
+
+    def changed(self, ticker, doc_hash):
+        return self.hashes.get(ticker) != doc_hash
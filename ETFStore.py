@@ -0,0 +1,272 @@
+from ETF import ETF
+import datetime
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+"""
+Columnar store of the whole universe for cross-fund analytics.
+Every table type (holdings, asset_allocation, country_breakdown, ...) is
+one long-format Parquet dataset (ticker, key, allocation), plus a `funds`
+dataset with the scalar fields, partitioned by snapshot date:
+
+    <root>/<table>/snapshot=YYYY-MM-DD/part-0.parquet
+
+Reads are memory-mapped and push column selection and predicates down to
+the Parquet row groups, so "all funds holding AAPL" is one vectorized scan.
+"""
+
+TABLES = tuple(dict.fromkeys(key for regex, key, columns in ETF.TABLE_SPECS)) + ('holdings',)
+
+FUND_FIELDS = [
+    ('ticker', pa.string()),
+    ('name', pa.string()),
+    ('category', pa.string()),
+    ('asset_class', pa.string()),
+    ('expense_ratio', pa.float64()),
+    ('aum', pa.float64()),
+    ('shares', pa.float64()),
+    ('index', pa.string()),
+]
+
+PARTITIONING = ds.partitioning(pa.schema([('snapshot', pa.string())]), flavor='hive')
+
+
+def today():
+    return datetime.date.today().isoformat()
+
+
+class _TableBuffer:
+    '''
+    Column buffers of one long table, flushed to a ParquetWriter as record
+    batches so a full universe never sits in memory at once.
+    '''
+
+    def __init__(self, path, batch_rows):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.columns = None
+        self.rows = 0
+        self.writer = None
+
+    def add(self, columns):
+        if self.columns is None:
+            self.columns = {name: [] for name in columns}
+        for name, values in self.columns.items():
+            values.extend(columns.get(name, [None] * len(columns['ticker'])))
+        self.rows += len(columns['ticker'])
+        if self.rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        batch = pa.table({name: pa.array(values, type=pa.float64() if name == 'allocation'
+                                         else pa.string())
+                          for name, values in self.columns.items()})
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.writer = pq.ParquetWriter(self.path + '.tmp', batch.schema)
+        self.writer.write_table(batch)
+        self.columns = {name: [] for name in self.columns}
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.path + '.tmp', self.path)
+
+
+class ETFStore:
+    def __init__(self, root="etfstore", batch_rows=100000):
+        '''
+        root: directory holding one dataset per table.
+        batch_rows: rows buffered per table before a row group is written.
+        '''
+        self.root = root
+        self.batch_rows = batch_rows
+        self.filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+
+    def _path(self, table, snapshot):
+        return os.path.join(self.root, table, 'snapshot=' + snapshot, 'part-0.parquet')
+
+    def write(self, etfs, snapshot=None):
+        '''
+        Write a snapshot (default: today) of ETF objects or toDict()
+        documents, replacing that snapshot if it exists. `etfs` can be any
+        iterable, e.g. read_ndjson(path, tables="frames").
+        Returns the number of funds written.
+        '''
+        snapshot = snapshot or today()
+        buffers = {}
+        funds = {name: [] for name, type in FUND_FIELDS}
+        count = 0
+        for etf in etfs:
+            if isinstance(etf, dict):
+                fields, tables = etf, etf.get('tables', {})
+            else:
+                fields, tables = vars(etf), etf.dataframes
+            for name, values in funds.items():
+                values.append(fields.get(name))
+            for table, frame in tables.items():
+                columns = self.long_columns(fields['ticker'], frame)
+                if columns is None:
+                    continue
+                if table not in buffers:
+                    buffers[table] = _TableBuffer(self._path(table, snapshot), self.batch_rows)
+                buffers[table].add(columns)
+            count += 1
+        for buffer in buffers.values():
+            buffer.close()
+        for table in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            stale = self._path(table, snapshot)
+            if table not in buffers and table != 'funds' and os.path.exists(stale):
+                os.remove(stale)  # table no fund has any more
+        for name, type in FUND_FIELDS:
+            if type == pa.float64():
+                funds[name] = [value if isinstance(value, (int, float)) else None
+                               for value in funds[name]]
+        path = self._path('funds', snapshot)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(pa.table(funds, schema=pa.schema(FUND_FIELDS)), path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return count
+
+    @staticmethod
+    def long_columns(ticker, frame):
+        '''
+        Long-format columns of one fund table: its first column (the
+        holding ticker for holdings, whose Zacks frames start with the name)
+        becomes `key`, the allocation (last column) is kept, and any other
+        columns (the holding name) are kept under their own name.
+        '''
+        if isinstance(frame, list):  # toDict() records
+            frame = pd.DataFrame(frame)
+        elif isinstance(frame, dict):  # column-wise (ETFExport)
+            frame = pd.DataFrame(frame)
+        if frame is None or frame.empty:
+            return None
+        names = list(frame.columns)
+        key = 'ticker' if 'ticker' in names[:-1] else names[0]
+        columns = {'ticker': [ticker] * len(frame),
+                   'key': frame[key].astype(object).where(frame[key].notna(), None).tolist()}
+        for name in names[:-1]:
+            if name != key:
+                columns[name] = frame[name].astype(object).where(frame[name].notna(), None).tolist()
+        columns['allocation'] = pd.to_numeric(frame[names[-1]], errors='coerce').tolist()
+        return columns
+
+    def snapshots(self, table='funds'):
+        '''
+        Snapshot dates stored for a table, oldest first.
+        '''
+        path = os.path.join(self.root, table)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(path)
+                      if name.startswith('snapshot='))
+
+    def dataset(self, table):
+        '''
+        pyarrow dataset of a table over all snapshots (memory-mapped).
+        '''
+        return ds.dataset(os.path.join(os.path.abspath(self.root), table), format='parquet',
+                          partitioning=PARTITIONING, filesystem=self.filesystem)
+
+    def scan(self, table, columns=None, filter=None, snapshot=None):
+        '''
+        Arrow table of `table` for one snapshot (default: the latest, "all"
+        for every snapshot). Only `columns` are read, and `filter`, a pyarrow
+        expression or a {column: value or list of values} dict, is pushed
+        down to the Parquet row groups.
+        '''
+        filter = self.expression(filter)
+        if snapshot != 'all':
+            snapshot = snapshot or (self.snapshots(table) or [None])[-1]
+            if snapshot is None:
+                raise FileNotFoundError(os.path.join(self.root, table))
+            in_snapshot = pc.field('snapshot') == snapshot  # prunes the other partitions
+            filter = in_snapshot if filter is None else in_snapshot & filter
+        return self.dataset(table).to_table(columns=columns, filter=filter)
+
+    def read(self, table, columns=None, filter=None, snapshot=None):
+        '''
+        scan() as a DataFrame.
+        '''
+        return self.scan(table, columns, filter, snapshot).to_pandas()
+
+    @staticmethod
+    def expression(filter):
+        if filter is None or isinstance(filter, ds.Expression):
+            return filter
+        expression = None
+        for column, value in filter.items():
+            if isinstance(value, (list, tuple, set)):
+                term = pc.field(column).isin(list(value))
+            else:
+                term = pc.field(column) == value
+            expression = term if expression is None else expression & term
+        return expression
+
+    def holders(self, keys, snapshot=None):
+        '''
+        Funds holding any of `keys` (holding tickers), largest allocation
+        first: DataFrame of ticker, key, name, allocation.
+        '''
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        frame = self.read('holdings', ['ticker', 'key', 'name', 'allocation'],
+                          {'key': keys}, snapshot)
+        return frame.sort_values('allocation', ascending=False, ignore_index=True)
+
+    def exposure(self, table, snapshot=None, filter=None):
+        '''
+        Universe-wide exposure per key of a table (e.g. country_breakdown):
+        sum over funds of allocation * AUM, largest first.
+        '''
+        snapshot = snapshot or self.snapshots(table)[-1]
+        long = self.scan(table, ['ticker', 'key', 'allocation'], filter, snapshot)
+        funds = self.scan('funds', ['ticker', 'aum'], None, snapshot)
+        joined = long.join(funds, 'ticker')
+        dollars = pc.multiply(joined['allocation'], pc.fill_null(joined['aum'], 0.0))
+        grouped = pa.table({'key': joined['key'], 'exposure': dollars}) \
+            .group_by('key').aggregate([('exposure', 'sum')])
+        return pd.Series(grouped['exposure_sum'].to_numpy(zero_copy_only=False),
+                         index=grouped['key'].to_pylist(), name='exposure') \
+            .sort_values(ascending=False)
+
+    def frames(self, ticker, snapshot=None):
+        '''
+        Tables of one fund back in the ETF.dataframes shape (column names
+        from TABLE_SPECS).
+        '''
+        columns = {key: columns for regex, key, columns in ETF.TABLE_SPECS}
+        columns['holdings'] = ['ticker', 'name', 'allocation']
+        frames = {}
+        for table in TABLES:
+            if not self.snapshots(table):
+                continue
+            frame = self.read(table, None, {'ticker': ticker.upper()}, snapshot)
+            if frame.empty:
+                continue
+            frame = frame.drop(columns=['ticker', 'snapshot'])
+            frame.columns = columns[table][:len(frame.columns)]
+            frames[table] = frame
+        return frames
+
+
+if __name__ == "__main__":
+    import sys
+    from ETFExport import read_ndjson
+
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python " + sys.argv[0] + " export.ndjson [store_dir] [YYYY-MM-DD]")
+        sys.exit(1)
+    store = ETFStore(*sys.argv[2:3])
+    snapshot = sys.argv[3] if len(sys.argv) == 4 else None
+    count = store.write(read_ndjson(sys.argv[1]), snapshot)
+    print("{} ETFs written to {} ({})".format(count, store.root, snapshot or today()))
@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+import re
+import scipy.sparse as sp
+
+"""
+Holdings overlap and look-through exposure across the whole universe.
+All holdings tables become one sparse fund x security weight matrix, with
+holding tickers normalized into a single security index, so pairwise
+overlaps, most similar funds and portfolio look-through exposures are
+sparse matrix products instead of per-pair DataFrame merges.
+"""
+
+# "AAPL US", "AAPL UW Equity": exchange / Bloomberg suffixes
+EXCHANGE_SUFFIX = re.compile(r'\s+(?:[A-Z]{2}(?:\s+EQUITY)?|EQUITY)$')
+# "BRK/B", "BRK-B", "BRK B": share class separators
+SHARE_CLASS = re.compile(r'[/\-\s]+(?=[A-Z]$)')
+NO_TICKER = {'', '-', '--', 'N/A', 'NA', 'NAN', 'NONE'}
+NAME_JUNK = re.compile(r'[^A-Z0-9]+')
+
+
+def normalize_tickers(keys, names=None, aliases=None):
+    '''
+    Security index keys of holding tickers: upper case, without exchange
+    suffixes, share classes as "BRK.B". Holdings without a ticker are keyed
+    by their normalized name ("NAME:ISHARES CORE ..."). aliases maps
+    normalized keys onto the key to use instead. Placeholders left without
+    a ticker or a name become '', which from_long drops: they are not a
+    security every such fund shares.
+    '''
+    codes, uniques = pd.factorize(pd.Series(keys, dtype=object).fillna('').astype(str))
+    uniques = pd.Series(uniques, dtype=object).str.strip().str.upper()  # each distinct key once
+    uniques = uniques.str.lstrip('$').str.replace(EXCHANGE_SUFFIX, '', regex=True)
+    uniques = uniques.str.replace(SHARE_CLASS, '.', regex=True)
+    keys = pd.Series(uniques.to_numpy(dtype=object)[codes], dtype=object)
+    if names is not None:
+        missing = keys.isin(NO_TICKER)
+        if missing.any():
+            named = pd.Series(names, dtype=object)[missing.values].fillna('').astype(str)
+            keys[missing] = 'NAME:' + named.str.upper().str.replace(NAME_JUNK, ' ', regex=True).str.strip().values
+    if aliases:
+        keys = keys.replace(aliases)
+    keys[keys.isin(NO_TICKER) | (keys == 'NAME:')] = ''
+    return keys.to_numpy(dtype=object)
+
+
+class HoldingsMatrix:
+    def __init__(self, funds, securities, weights):
+        '''
+        funds, securities: row and column labels.
+        weights: sparse fund x security allocation matrix (converted to CSR).
+        '''
+        self.funds = np.asarray(funds, dtype=object)
+        self.securities = np.asarray(securities, dtype=object)
+        self.weights = sp.csr_matrix(weights, dtype=np.float64)
+        self.fund_index = {fund: i for i, fund in enumerate(self.funds)}
+        self.security_index = {security: j for j, security in enumerate(self.securities)}
+        self._similarity = None
+
+    @classmethod
+    def from_long(cls, frame, aliases=None):
+        '''
+        Matrix from a long holdings table with ticker (fund), key (holding
+        ticker), allocation and optionally name columns, as read from
+        ETFStore.read('holdings'). Duplicate holdings are summed.
+        '''
+        keys = normalize_tickers(frame['key'], frame['name'] if 'name' in frame else None, aliases)
+        valid = (keys != '') & frame['allocation'].notna().to_numpy()
+        funds, rows = np.unique(frame['ticker'].to_numpy(dtype=object)[valid], return_inverse=True)
+        securities, columns = np.unique(keys[valid], return_inverse=True)
+        weights = sp.coo_matrix((frame['allocation'].to_numpy(dtype=np.float64)[valid], (rows, columns)),
+                                shape=(len(funds), len(securities)))
+        return cls(funds, securities, weights.tocsr())  # tocsr sums duplicates
+
+    @classmethod
+    def from_etfs(cls, etfs, aliases=None):
+        '''
+        Matrix from the holdings of ETF objects or ETFRecords.
+        '''
+        tickers, keys, names, allocations = [], [], [], []
+        for etf in etfs:
+            if hasattr(etf, 'table'):  # ETFRecord
+                columns, arrays = etf.tables.get('holdings', ((), ()))
+                holdings = dict(zip(columns, arrays))
+            else:
+                holdings = etf.holdings
+            if holdings is None or len(holdings['allocation']) == 0:
+                continue
+            count = len(holdings['allocation'])
+            tickers.extend([etf.ticker] * count)
+            keys.extend(list(holdings['ticker']))
+            names.extend(list(holdings['name']))
+            allocations.extend(list(holdings['allocation']))
+        return cls.from_long(pd.DataFrame({'ticker': tickers, 'key': keys, 'name': names,
+                                           'allocation': allocations}, dtype=object)
+                             .astype({'allocation': np.float64}), aliases)
+
+    def _rows(self, funds):
+        return [self.fund_index[fund] for fund in funds]
+
+    def holders(self):
+        '''
+        Binary fund x security matrix.
+        '''
+        binary = self.weights.copy()
+        binary.data = np.ones_like(binary.data)
+        return binary
+
+    def common_counts(self):
+        '''
+        Sparse fund x fund matrix of the number of securities held in common.
+        '''
+        binary = self.holders()
+        return (binary @ binary.T).tocsr()
+
+    def shared_weight(self):
+        '''
+        Sparse fund x fund matrix whose (i, j) entry is the weight of fund i
+        in securities that fund j also holds.
+        '''
+        return (self.weights @ self.holders().T).tocsr()
+
+    def similarity(self):
+        '''
+        Sparse fund x fund cosine similarity of the weight vectors (cached).
+        '''
+        if self._similarity is None:
+            norms = np.sqrt(np.asarray(self.weights.multiply(self.weights).sum(axis=1)).ravel())
+            scale = sp.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0))
+            normalized = scale @ self.weights
+            self._similarity = (normalized @ normalized.T).tocsr()
+        return self._similarity
+
+    def overlap(self, a, b):
+        '''
+        Weight overlap of two funds: sum over common securities of the
+        smaller of the two allocations.
+        '''
+        row_a, row_b = self.weights[self.fund_index[a]], self.weights[self.fund_index[b]]
+        return float(row_a.minimum(row_b).sum())
+
+    def overlaps(self, pairs):
+        '''
+        Weight overlap of many (a, b) fund pairs at once.
+        '''
+        pairs = list(pairs)
+        if not pairs:
+            return np.zeros(0)
+        rows_a = self.weights[self._rows(a for a, b in pairs)]
+        rows_b = self.weights[self._rows(b for a, b in pairs)]
+        return np.asarray(rows_a.minimum(rows_b).sum(axis=1)).ravel()
+
+    def top_k(self, fund, k=10, by="similarity"):
+        '''
+        The k funds most similar to `fund` (by "similarity" or
+        "shared_weight"), with the number of common holdings and the weight
+        overlap, most similar first.
+        '''
+        row = self.fund_index[fund]
+        scores = (self.similarity() if by == "similarity" else self.shared_weight())[row]
+        candidates, values = scores.indices, scores.data
+        keep = candidates != row
+        candidates, values = candidates[keep], values[keep]
+        if len(candidates) > k:
+            best = np.argpartition(-values, k)[:k]
+            candidates, values = candidates[best], values[best]
+        order = np.argsort(-values, kind='stable')
+        candidates, values = candidates[order], values[order]
+        others = self.funds[candidates]
+        binary = self.holders()
+        common = (binary[row] @ binary.T).toarray().ravel()[candidates].astype(np.int64)
+        return pd.DataFrame({'ticker': others, by: values, 'common': common,
+                             'overlap': self.overlaps((fund, other) for other in others)})
+
+    def top_k_all(self, k=10):
+        '''
+        (indices, scores) arrays of shape (funds, k) of the k most similar
+        funds of every fund, -1 / 0 padded.
+        '''
+        similarity = self.similarity()
+        indices = np.full((len(self.funds), k), -1, dtype=np.int64)
+        scores = np.zeros((len(self.funds), k))
+        indptr, columns, data = similarity.indptr, similarity.indices, similarity.data
+        for row in range(len(self.funds)):
+            candidates = columns[indptr[row]:indptr[row + 1]]
+            values = data[indptr[row]:indptr[row + 1]]
+            keep = candidates != row
+            candidates, values = candidates[keep], values[keep]
+            if len(candidates) > k:
+                best = np.argpartition(-values, k)[:k]
+                candidates, values = candidates[best], values[best]
+            order = np.argsort(-values, kind='stable')
+            indices[row, :len(order)] = candidates[order]
+            scores[row, :len(order)] = values[order]
+        return indices, scores
+
+    def portfolio_vector(self, portfolio):
+        '''
+        Dense fund weight vector(s) of a portfolio: a {fund: weight} dict or
+        Series, or an array of shape (funds,) or (portfolios, funds).
+        Funds without holdings data are ignored.
+        '''
+        if isinstance(portfolio, (dict, pd.Series)):
+            vector = np.zeros(len(self.funds))
+            for fund, weight in dict(portfolio).items():
+                if fund in self.fund_index:
+                    vector[self.fund_index[fund]] += weight
+            return vector
+        return np.asarray(portfolio, dtype=np.float64)
+
+    def exposure(self, portfolio, top=None):
+        '''
+        Look-through exposure of a portfolio to every security (weights @
+        matrix), largest first; a DataFrame (securities x portfolios) for a
+        matrix of portfolios.
+        '''
+        vector = self.portfolio_vector(portfolio)
+        exposure = self.weights.T @ vector.T
+        if exposure.ndim == 1:
+            series = pd.Series(exposure, index=self.securities, name='exposure')
+            series = series[series != 0].sort_values(ascending=False)
+            return series.head(top) if top else series
+        return pd.DataFrame(exposure, index=self.securities)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # funds sharing only placeholder lines do not overlap
+    placeholders = pd.DataFrame({'ticker': ['A', 'A', 'B', 'B', 'B', 'B'],
+                                 'key': ['--', 'X', '--', 'N/A', None, 'Y'],
+                                 'name': [None, 'x', None, '', '  ', 'y'],
+                                 'allocation': [0.5, 0.5, 0.3, 0.2, 0.2, 0.3]})
+    for frame in (placeholders, placeholders.drop(columns='name')):
+        check = HoldingsMatrix.from_long(frame)
+        assert check.overlap('A', 'B') == 0 and check.similarity()[0, 1] == 0, \
+            "placeholder holdings overlap"
+
+    # synthetic universe: popularity of securities follows a power law
+    funds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    securities = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = np.random.default_rng(0)
+    popularity = 1.0 / np.arange(1, securities + 1) ** 0.8
+    popularity /= popularity.sum()
+    tickers, keys, allocations = [], [], []
+    for fund in range(funds):
+        count = int(rng.integers(20, 500))
+        held = rng.choice(securities, size=count, replace=False, p=popularity)
+        weights = rng.pareto(1.5, count) + 1
+        tickers.extend(["F{}".format(fund)] * count)
+        keys.extend("S{}".format(security) for security in held)
+        allocations.extend(weights / weights.sum())
+    frame = pd.DataFrame({'ticker': tickers, 'key': keys, 'allocation': allocations})
+
+    timings = []
+    start = time.perf_counter()
+    matrix = HoldingsMatrix.from_long(frame)
+    timings.append(("build", time.perf_counter() - start))
+    start = time.perf_counter()
+    similarity = matrix.similarity()
+    timings.append(("all-pairs similarity", time.perf_counter() - start))
+    start = time.perf_counter()
+    counts = matrix.common_counts()
+    timings.append(("all-pairs common holdings", time.perf_counter() - start))
+    start = time.perf_counter()
+    matrix.top_k_all(10)
+    timings.append(("top-10 of every fund", time.perf_counter() - start))
+    start = time.perf_counter()
+    portfolios = rng.dirichlet(np.ones(funds) * 0.01, size=100)
+    matrix.exposure(portfolios)
+    timings.append(("look-through of 100 portfolios", time.perf_counter() - start))
+    print("{} funds x {} securities, {} holdings, {} similar pairs".format(
+        len(matrix.funds), len(matrix.securities), matrix.weights.nnz, similarity.nnz))
+    for name, seconds in timings:
+        print("{:<32} {:8.3f}s".format(name, seconds))
@@ -0,0 +1,237 @@
+from collections import OrderedDict
+import http.client
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import zlib
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Pooled keep-alive HTTP client shared by all ETF sources.
+Connections are reused per host, responses are requested compressed and
+decoded transparently, and pages seen before are revalidated with
+If-None-Match / If-Modified-Since so unchanged pages come back as 304s.
+With a PageCache as store, fresh pages are served without any request.
+"""
+
+USER_AGENT = "Python-urllib/%d.%d" % sys.version_info[:2]
+
+
+class MemoryStore:
+    '''
+    In-memory store of the last body and validators of each URL, used to
+    revalidate pages. Least recently used entries are dropped past max_bytes.
+    '''
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, url):
+        '''
+        dict with body, etag and last_modified, or None.
+        '''
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def store(self, url, body, etag=None, last_modified=None):
+        if etag is None and last_modified is None:
+            return  # nothing to revalidate with
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self.size -= len(old['body'])
+            self._entries[url] = {'body': body, 'etag': etag,
+                                  'last_modified': last_modified}
+            self.size += len(body)
+            while self.size > self.max_bytes and self._entries:
+                self.size -= len(self._entries.popitem(last=False)[1]['body'])
+
+    def revalidated(self, url):
+        pass
+
+
+class HttpSession:
+    def __init__(self, timeout=30, max_per_host=8, store=None, max_redirects=5,
+                 offline=False):
+        '''
+        timeout: connect/read timeout in seconds.
+        max_per_host: idle connections kept open per host.
+        store: MemoryStore or PageCache (lookup/store/revalidated) used for
+        conditional requests, None disables revalidation.
+        offline: serve pages from the store only, never touch the network.
+        '''
+        self.timeout = timeout
+        self.offline = offline
+        self.max_per_host = max_per_host
+        self.store = store
+        self.max_redirects = max_redirects
+        self.headers = {'User-Agent': USER_AGENT,
+                        'Accept-Encoding': 'gzip, deflate, br' if brotli else 'gzip, deflate'}
+        self.stats = {'requests': 0, 'connections': 0, 'bytes': 0,
+                      'decoded_bytes': 0, 'not_modified': 0, 'redirects': 0,
+                      'cache_hits': 0}
+        self.host_stats = {}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        '''
+        Body of `url`, following redirects.
+        Raises urllib.error.HTTPError on 4xx/5xx responses, like urlopen,
+        and with code 504 for pages missing from the store when offline.
+        '''
+        requested = url
+        for _ in range(self.max_redirects + 1):
+            entry = self.store.lookup(url) if self.store is not None else None
+            if entry is not None and (self.offline or entry.get('fresh')):
+                self._count(url, cache_hits=1)
+                return entry['body']
+            if self.offline:
+                raise urllib.error.HTTPError(url, 504, "Not cached (offline)", None, None)
+            headers = dict(self.headers)
+            if entry is not None:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            response, raw = self._request(url, headers)
+            status = response.status
+            if status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                self._count(url, redirects=1)
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if status == 304 and entry is not None:
+                self._count(url, not_modified=1)
+                self.store.revalidated(url)
+                return entry['body']
+            if status >= 400:
+                raise urllib.error.HTTPError(url, status, response.reason,
+                                             response.headers, None)
+            body = self.decode(raw, response.getheader('Content-Encoding'))
+            self._count(url, decoded_bytes=len(body))
+            if self.store is not None:
+                self.store.store(url, body, response.getheader('ETag'),
+                                 response.getheader('Last-Modified'))
+                if url != requested:  # so the original URL hits next time
+                    self.store.store(requested, body, response.getheader('ETag'),
+                                     response.getheader('Last-Modified'))
+            return body
+        raise urllib.error.HTTPError(url, 310, "Too many redirects", None, None)
+
+    def _request(self, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                raw = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if reused:  # the server closed an idle keep-alive connection
+                    continue
+                raise
+            self._count(url, requests=1, bytes=len(raw))
+            self._release(key, conn, response.will_close)
+            return response, raw
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        self._count_host(host, connections=1)
+        return conn, False
+
+    def _release(self, key, conn, will_close):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if not will_close and len(idle) < self.max_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _count(self, url, **counts):
+        self._count_host(urllib.parse.urlsplit(url).hostname, **counts)
+
+    def _count_host(self, host, **counts):
+        with self._lock:
+            stats = self.host_stats.setdefault(host, dict.fromkeys(self.stats, 0))
+            for name, value in counts.items():
+                self.stats[name] += value
+                stats[name] += value
+
+    @staticmethod
+    def decode(raw, encoding):
+        encoding = (encoding or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            return zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(raw)
+            except zlib.error:  # raw deflate stream without zlib header
+                return zlib.decompress(raw, -zlib.MAX_WBITS)
+        if encoding == 'br' and brotli is not None:
+            return brotli.decompress(raw)
+        return raw
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def summary(self):
+        '''
+        One line per host with requests, connections and bytes transferred.
+        '''
+        lines = []
+        for host, stats in sorted(self.host_stats.items(), key=lambda item: str(item[0])):
+            lines.append("{:<24} {requests:>6} requests {connections:>4} connections "
+                         "{bytes:>12} bytes ({decoded_bytes} decoded) "
+                         "{not_modified} not modified {cache_hits} cached".format(str(host), **stats))
+        return "\n".join(lines)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_session():
+    '''
+    Process-wide session used by ETF when no fetcher is given.
+    '''
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpSession(store=MemoryStore())
+        return _shared
+
+
+def set_shared_session(session):
+    '''
+    Replace the process-wide session, e.g. with one backed by a PageCache.
+    '''
+    global _shared
+    with _shared_lock:
+        _shared = session
@@ -0,0 +1,256 @@
+from contextlib import contextmanager
+import json
+import numpy as np
+import threading
+import time
+
+"""
+Scraper instrumentation: latency of every phase (page fetch, soup build,
+each field and table, Zacks fallback) and success / failure counts per
+field and source, dumped as JSON or Prometheus text.
+ETF records into the process-wide metrics unless given its own.
+"""
+
+PREFIX = "etf_scraper"
+
+
+def _key(phase, labels):
+    return (phase,) + tuple(sorted(labels.items()))
+
+
+def _name(key):
+    '''
+    "phase" or "phase:value,value" of a metrics key, for summaries.
+    '''
+    phase, labels = key[0], key[1:]
+    return phase + (":" + ",".join(str(value) for name, value in labels) if labels else "")
+
+
+class Metrics:
+    def __init__(self):
+        self.timings = {}  # (phase, (label, value)...) -> [seconds]
+        self.counts = {}  # (phase, (label, value)..., ('outcome', ...)) -> n
+        self._lock = threading.Lock()
+
+    def observe(self, phase, seconds, **labels):
+        key = _key(phase, labels)
+        with self._lock:
+            self.timings.setdefault(key, []).append(seconds)
+
+    def count(self, phase, outcome, n=1, **labels):
+        key = _key(phase, dict(labels, outcome=outcome))
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    @contextmanager
+    def time(self, phase, **labels):
+        '''
+        Time a block and count its outcome: "ok", "missing" (KeyError, e.g.
+        a label the page does not have) or "error". Exceptions propagate.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        except KeyError:
+            self.count(phase, "missing", **labels)
+            raise
+        except BaseException:
+            self.count(phase, "error", **labels)
+            raise
+        else:
+            self.count(phase, "ok", **labels)
+        finally:
+            self.observe(phase, time.perf_counter() - start, **labels)
+
+    def merge(self, other):
+        '''
+        Add the observations of another Metrics or of its to_dict(), e.g.
+        from a worker process.
+        '''
+        if isinstance(other, Metrics):
+            other = other.to_dict(raw=True)
+        with self._lock:
+            for entry in other['timings']:
+                key = _key(entry['phase'], entry['labels'])
+                self.timings.setdefault(key, []).extend(entry['seconds'])
+            for entry in other['counts']:
+                key = _key(entry['phase'], dict(entry['labels'], outcome=entry['outcome']))
+                self.counts[key] = self.counts.get(key, 0) + entry['count']
+
+    def clear(self):
+        with self._lock:
+            self.timings, self.counts = {}, {}
+
+    def summary(self, quantiles=(50, 95)):
+        '''
+        {name: {'count', 'total', 'p50', 'p95'}} of every phase.
+        '''
+        with self._lock:
+            timings = {key: list(values) for key, values in self.timings.items()}
+        result = {}
+        for key, values in sorted(timings.items(), key=lambda item: _name(item[0])):
+            stats = {'count': len(values), 'total': float(np.sum(values))}
+            for q, value in zip(quantiles, np.percentile(values, quantiles)):
+                stats['p{}'.format(q)] = float(value)
+            result[_name(key)] = stats
+        return result
+
+    def report(self):
+        '''
+        Text table of the phase latencies (ms) and failure counts.
+        '''
+        lines = ["{:<40} {:>7} {:>9} {:>9} {:>10}".format("phase", "count", "p50 ms", "p95 ms", "total s")]
+        for name, stats in self.summary().items():
+            lines.append("{:<40} {count:>7} {:>9.2f} {:>9.2f} {total:>10.2f}".format(
+                name, stats['p50'] * 1000, stats['p95'] * 1000, **stats))
+        failures = {}
+        with self._lock:
+            for key, n in self.counts.items():
+                labels = dict(key[1:])
+                if labels['outcome'] != "ok":
+                    del labels['outcome']
+                    name = _name(_key(key[0], labels))
+                    failures[name] = failures.get(name, "") + " {} {}".format(n, dict(key[1:])['outcome'])
+        for name in sorted(failures):
+            lines.append("{:<40}{}".format(name, failures[name]))
+        return "\n".join(lines)
+
+    def to_dict(self, raw=False):
+        '''
+        JSON-ready dict: per-phase summaries (or the raw seconds with
+        raw=True) and outcome counts.
+        '''
+        with self._lock:
+            timings = {key: list(values) for key, values in self.timings.items()}
+            counts = dict(self.counts)
+        result = {'timings': [], 'counts': []}
+        for key, values in timings.items():
+            entry = {'phase': key[0], 'labels': dict(key[1:])}
+            if raw:
+                entry['seconds'] = values
+            else:
+                entry.update(count=len(values), total=float(np.sum(values)),
+                             p50=float(np.percentile(values, 50)),
+                             p95=float(np.percentile(values, 95)))
+            result['timings'].append(entry)
+        for key, n in counts.items():
+            labels = dict(key[1:])
+            outcome = labels.pop('outcome')
+            result['counts'].append({'phase': key[0], 'labels': labels,
+                                     'outcome': outcome, 'count': n})
+        return result
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix=PREFIX):
+        '''
+        Prometheus text exposition: a summary of phase latencies (with 0.5
+        and 0.95 quantiles) and a counter of outcomes.
+        '''
+        def labels(pairs):
+            return ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                            for name, value in pairs)
+
+        lines = ["# HELP {}_phase_seconds Latency of each scraping phase.".format(prefix),
+                 "# TYPE {}_phase_seconds summary".format(prefix)]
+        with self._lock:
+            timings = {key: list(values) for key, values in self.timings.items()}
+            counts = dict(self.counts)
+        for key, values in sorted(timings.items()):
+            pairs = [('phase', key[0])] + list(key[1:])
+            for q in (0.5, 0.95):
+                lines.append("{}_phase_seconds{{{}}} {}".format(
+                    prefix, labels(pairs + [('quantile', q)]), np.percentile(values, q * 100)))
+            lines.append("{}_phase_seconds_sum{{{}}} {}".format(prefix, labels(pairs), float(np.sum(values))))
+            lines.append("{}_phase_seconds_count{{{}}} {}".format(prefix, labels(pairs), len(values)))
+        lines += ["# HELP {}_outcomes_total Outcomes of each phase.".format(prefix),
+                  "# TYPE {}_outcomes_total counter".format(prefix)]
+        for key, n in sorted(counts.items()):
+            lines.append("{}_outcomes_total{{{}}} {}".format(
+                prefix, labels([('phase', key[0])] + list(key[1:])), n))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        '''
+        Write the metrics to `path`: Prometheus text for .prom / .txt files,
+        JSON otherwise.
+        '''
+        with open(path, 'w') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                f.write(self.to_json(indent=1))
+
+
+_shared = Metrics()
+
+
+def shared_metrics():
+    '''
+    Process-wide metrics used by ETF when none is given.
+    '''
+    return _shared
+
+
+def profile(ticker, parser="html5lib", profiler="cProfile", pages=None, output=None):
+    '''
+    Build one ETF under cProfile or pyinstrument and print the profile
+    (or save it to `output`). pages: raw pages as for ETF.from_html, to
+    profile without network access. Returns the ETF.
+    '''
+    from ETF import ETF
+
+    def build():
+        if pages is not None:
+            etf = ETF.from_html(ticker, parser=parser, **pages)
+        else:
+            etf = ETF(ticker, parser=parser)
+        etf.dataframes
+        return etf
+
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        session = Profiler()
+        session.start()
+        etf = build()
+        session.stop()
+        if output:
+            with open(output, 'w') as f:
+                f.write(session.output_html())
+        else:
+            print(session.output_text(unicode=True, color=False))
+        return etf
+    import cProfile
+    import pstats
+    session = cProfile.Profile()
+    etf = session.runcall(build)
+    if output:
+        session.dump_stats(output)
+    else:
+        pstats.Stats(session).sort_stats('cumulative').print_stats(30)
+    return etf
+
+
+if __name__ == "__main__":
+    import argparse
+    from ETFPage import PARSERS
+
+    argparser = argparse.ArgumentParser(
+        description="Profile the scraping of one ETF and print its phase metrics.")
+    argparser.add_argument('ticker')
+    argparser.add_argument('--parser', choices=PARSERS, default="html5lib")
+    argparser.add_argument('--profiler', choices=("cProfile", "pyinstrument"), default="cProfile")
+    argparser.add_argument('--corpus', default=None,
+                           help="read the pages from corpus/<TICKER>/ instead of the network")
+    argparser.add_argument('--output', default=None,
+                           help="save the profile (cProfile stats, pyinstrument HTML)")
+    args = argparser.parse_args()
+
+    pages = None
+    if args.corpus:
+        from ParserCheck import load_pages
+        import os
+        pages = load_pages(os.path.join(args.corpus, args.ticker.upper()))
+    etf = profile(args.ticker, args.parser, args.profiler, pages, args.output)
+    print(etf.metrics.report())
@@ -0,0 +1,107 @@
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+import threading
+
+"""
+Bulk sync of ETF documents into a MongoDB collection.
+Existing tickers are fetched with a single query and documents are written
+in batched, unordered bulk upserts as they stream in.
+"""
+
+
+class MongoSync:
+    def __init__(self, collection, batch_size=100):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.stats = {'upserted': 0, 'modified': 0, 'errors': 0, 'batches': 0,
+                      'failed_batches': 0}
+        self._ops = []
+        self._threshold = batch_size  # queued ops that trigger a write
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def ensureIndexes(self):
+        '''
+        Unique index on ticker, plus the fields OptimalPortfolio.Rmd filters
+        and sorts on.
+        '''
+        try:
+            self.collection.create_index([('ticker', ASCENDING)], unique=True)
+        except OperationFailure as e:
+            print("Could not create unique ticker index (duplicate tickers?): " + str(e))
+        self.collection.create_index([('asset_class', ASCENDING), ('category', ASCENDING)])
+        self.collection.create_index([('category', ASCENDING), ('asset_class', ASCENDING)])
+
+    def existing(self, tickers):
+        '''
+        Set of the given tickers already in the collection, in one query.
+        '''
+        cursor = self.collection.find({'ticker': {'$in': list(tickers)}},
+                                      {'ticker': True, '_id': False})
+        return {doc['ticker'] for doc in cursor}
+
+    def add(self, doc):
+        '''
+        Queue an upsert of an ETF document (toDict()), flushing full batches.
+        Safe to call from several threads.
+        '''
+        self._queue(ReplaceOne({'ticker': doc['ticker']}, doc, upsert=True))
+
+    def _queue(self, op):
+        with self._lock:
+            self._ops.append(op)
+            if len(self._ops) < self._threshold:
+                return
+            ops, self._ops = self._ops, []
+        self._write(ops)
+
+    def touch(self, ticker, meta):
+        '''
+        Queue an update of only the `_refresh` bookkeeping of a document
+        whose content did not change.
+        '''
+        self._queue(UpdateOne({'ticker': ticker}, {'$set': {'_refresh': meta}}))
+
+    def flush(self):
+        '''
+        Write every queued op. Returns False if the write failed, the ops
+        then stay queued (see unwritten).
+        '''
+        with self._lock:
+            ops, self._ops = self._ops, []
+        if ops:
+            return self._write(ops)
+        return True
+
+    @property
+    def unwritten(self):
+        return len(self._ops)
+
+    def _write(self, ops):
+        try:
+            result = self.collection.bulk_write(ops, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            print("{} of {} writes failed".format(len(details['writeErrors']), len(ops)))
+        except PyMongoError as e:
+            # nothing known to be written (connection, timeout): queue the
+            # ops again, retried with the next full batch or flush
+            print("Bulk write of {} ops failed: {}".format(len(ops), e))
+            with self._lock:
+                self._ops[:0] = ops
+                self._threshold = len(self._ops) + self.batch_size
+                self.stats['failed_batches'] += 1
+            return False
+        with self._lock:
+            self._threshold = self.batch_size
+            self.stats['batches'] += 1
+            self.stats['upserted'] += details.get('nUpserted', 0)
+            self.stats['modified'] += details.get('nModified', 0)
+            self.stats['errors'] += len(details.get('writeErrors', []))
+        return True
@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+"""
+Persistent cache of raw HTTP responses keyed by URL.
+Bodies are stored zlib-compressed in a SQLite file together with their
+validators, so HttpSession can serve fresh pages without any request and
+revalidate stale ones. Entries expire per source (host) and the least
+recently used ones are evicted past the size limit. SQLite locking makes the
+cache safe to share between threads and worker processes.
+Reads stay read-only: access times are only rewritten once they are older
+than a fraction of the page TTL, and the total size is kept up to date by
+triggers instead of being summed on every store.
+"""
+
+DAY = 24 * 60 * 60
+
+# host suffix -> seconds a page stays fresh
+TTLS = {
+    'etfdb.com': 7 * DAY,  # descriptions and classification rarely change
+    'etfdailynews.com': DAY,  # holdings change daily
+    'zacks.com': DAY,
+}
+
+
+class PageCache:
+    def __init__(self, path="pages.sqlite", ttls=None, default_ttl=DAY,
+                 max_bytes=1024 * 1024 * 1024, level=6, touch_fraction=0.1):
+        '''
+        ttls: host suffix -> seconds, defaults to TTLS; other hosts get
+        default_ttl.
+        max_bytes: limit of the compressed bodies, least recently used
+        pages are evicted past it.
+        touch_fraction: a hit rewrites the access time of a page only when
+        it is older than this fraction of the page TTL.
+        '''
+        self.path = path
+        self.ttls = ttls if ttls is not None else TTLS
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.level = level
+        self.touch_fraction = touch_fraction
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, body BLOB, size INTEGER, etag TEXT,
+                last_modified TEXT, fetched_at REAL, accessed_at REAL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+            db.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                       "size INTEGER)")
+            # caches created before the totals table start from the current sum
+            db.execute("INSERT OR IGNORE INTO totals SELECT 0, COALESCE(SUM(size), 0) FROM pages")
+            db.execute("""CREATE TRIGGER IF NOT EXISTS pages_insert AFTER INSERT ON pages
+                BEGIN UPDATE totals SET size = size + new.size; END""")
+            db.execute("""CREATE TRIGGER IF NOT EXISTS pages_delete AFTER DELETE ON pages
+                BEGIN UPDATE totals SET size = size - old.size; END""")
+            db.execute("""CREATE TRIGGER IF NOT EXISTS pages_update AFTER UPDATE OF size ON pages
+                BEGIN UPDATE totals SET size = size + new.size - old.size; END""")
+
+    def _db(self):
+        '''
+        Connection of the calling thread (sqlite3 connections are not shared).
+        '''
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def ttl(self, url):
+        hostname = urllib.parse.urlsplit(url).hostname or ''
+        for suffix, ttl in self.ttls.items():
+            if hostname == suffix or hostname.endswith('.' + suffix):
+                return ttl
+        return self.default_ttl
+
+    def lookup(self, url):
+        '''
+        dict with body, etag, last_modified, fetched_at and fresh, or None.
+        '''
+        db = self._db()
+        row = db.execute("SELECT body, etag, last_modified, fetched_at, accessed_at FROM pages "
+                         "WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, fetched_at, accessed_at = row
+        now = time.time()
+        ttl = self.ttl(url)
+        if now - accessed_at > ttl * self.touch_fraction:
+            with db:
+                db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (now, url))
+        return {'body': zlib.decompress(body), 'etag': etag,
+                'last_modified': last_modified, 'fetched_at': fetched_at,
+                'fresh': now - fetched_at < ttl}
+
+    def store(self, url, body, etag=None, last_modified=None):
+        blob = zlib.compress(body, self.level)
+        now = time.time()
+        with self._db() as db:
+            # an upsert, not INSERT OR REPLACE: REPLACE deletes without
+            # firing the delete trigger
+            db.execute("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE "
+                       "SET body = excluded.body, size = excluded.size, etag = excluded.etag, "
+                       "last_modified = excluded.last_modified, fetched_at = excluded.fetched_at, "
+                       "accessed_at = excluded.accessed_at",
+                       (url, blob, len(blob), etag, last_modified, now, now))
+        self.evict()
+
+    def revalidated(self, url):
+        '''
+        Mark a page confirmed unchanged by the server (304) as fresh again.
+        '''
+        with self._db() as db:
+            db.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def size(self):
+        return self._db().execute("SELECT size FROM totals").fetchone()[0]
+
+    def evict(self):
+        '''
+        Drop least recently used pages until the cache fits in max_bytes.
+        '''
+        with self._db() as db:
+            excess = db.execute("SELECT size FROM totals").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return
+            urls = []
+            for url, size in db.execute("SELECT url, size FROM pages ORDER BY accessed_at"):
+                urls.append((url,))
+                excess -= size
+                if excess <= 0:
+                    break
+            db.executemany("DELETE FROM pages WHERE url = ?", urls)
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -0,0 +1,86 @@
+from ETF import ETF
+from ETFPage import PARSERS
+import json
+import os
+import sys
+
+"""
+Differential check of the page parser backends.
+Parses every saved ETF in a corpus directory with each backend and reports
+the fields where toDict() differs from the reference backend.
+Corpus layout: <corpus>/<TICKER>/{etfdb,holdings,zacks}.html, where only
+etfdb.html is required.
+"""
+
+
+def load_pages(path):
+    pages = {}
+    for source in ETF.SOURCES:
+        filename = os.path.join(path, source + ".html")
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                pages[source] = f.read()
+    return pages
+
+
+def diff(a, b, path=""):
+    '''
+    Paths where two toDict() outputs differ (NaN compares equal to NaN).
+    '''
+    if isinstance(a, dict) and isinstance(b, dict):
+        paths = []
+        for key in sorted(set(a) | set(b), key=str):
+            if key not in a or key not in b:
+                paths.append(path + "/" + str(key))
+            else:
+                paths += diff(a[key], b[key], path + "/" + str(key))
+        return paths
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return [path + " (length " + str(len(a)) + " != " + str(len(b)) + ")"]
+        paths = []
+        for i, (x, y) in enumerate(zip(a, b)):
+            paths += diff(x, y, path + "[" + str(i) + "]")
+        return paths
+    if json.dumps(a, default=str) != json.dumps(b, default=str):
+        return [path + ": " + repr(a) + " != " + repr(b)]
+    return []
+
+
+def check(corpus, parsers=PARSERS):
+    '''
+    Returns {ticker: {parser: [differing paths]}} against parsers[0].
+    '''
+    report = {}
+    for ticker in sorted(os.listdir(corpus)):
+        path = os.path.join(corpus, ticker)
+        if not os.path.isfile(os.path.join(path, "etfdb.html")):
+            continue
+        pages = load_pages(path)
+        reference = ETF.from_html(ticker, parser=parsers[0], **pages).toDict()
+        report[ticker] = {}
+        for parser in parsers[1:]:
+            other = ETF.from_html(ticker, parser=parser, **pages).toDict()
+            report[ticker][parser] = diff(reference, other)
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python " + sys.argv[0] + " corpus_dir")
+        sys.exit(1)
+
+    parsers = PARSERS
+    report = check(sys.argv[1], parsers)
+    failures = 0
+    for ticker, results in report.items():
+        for parser, paths in results.items():
+            if paths:
+                failures += 1
+                print("{} [{}] differs from {}:".format(ticker, parser, parsers[0]))
+                for path in paths:
+                    print("    " + path)
+    backends = {parser for results in report.values() for parser in results}
+    print("{} ETFs checked, {} backends compared, {} mismatches".format(
+        len(report), len(backends), failures))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,363 @@
+from AsyncDownloader import HOST_LIMITS, RETRY_STATUS
+from ETF import ETF
+from ETFExport import etf_columns, table_columns
+from HttpSession import HttpSession, MemoryStore
+from Metrics import Metrics, shared_metrics
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+from tqdm import tqdm  # progress bar
+import os
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+"""
+Staged scraping pipeline for large ETF universes.
+fetch threads -> bounded page queue -> parse processes -> single writer.
+Network I/O runs in threads, the CPU-bound parsing (tree building, regex
+scans, Zacks literal) in a pool of processes so it scales with cores, and
+one writer thread hands the compact records to the sink. Bounded queues
+give backpressure between stages.
+"""
+
+
+def parse_pages(ticker, pages, parser, columns=False):
+    '''
+    Parse worker: raw pages in, compact record out (runs in a child
+    process). Returns (ticker, record, needs_zacks, parse metrics); with
+    needs_zacks the record has no holdings yet, see parse_zacks.
+    columns: also add the column-wise export document (ETFExport), built
+    straight from the DataFrames.
+    '''
+    metrics = Metrics()
+    etf = ETF.from_html(ticker, parser=parser, metrics=metrics, **pages)
+    record = {'doc': etf.toDict(), 'page_hashes': etf.page_hashes}
+    if columns:
+        record['columns'] = etf_columns(etf)
+    return ticker, record, etf.holdings is None, metrics.to_dict(raw=True)
+
+
+def parse_zacks(ticker, record, html):
+    '''
+    Parse worker for the Zacks fallback: adds the Zacks holdings to a
+    record of parse_pages, as ETF does, without parsing the other pages again.
+    '''
+    metrics = Metrics()
+    record['page_hashes']['zacks'] = None
+    if html is not None:
+        record['page_hashes']['zacks'] = hashlib.sha1(html).hexdigest()
+        try:
+            with metrics.time('zacks'):
+                holdings = ETF.zacks_holdings(html.decode('cp1252'))
+            if holdings is None:
+                metrics.count('holdings', "missing", source='zacks')
+            else:
+                metrics.count('holdings', "ok", source='zacks')
+                record['doc']['tables']['holdings'] = holdings.to_dict(orient='records')
+                if 'columns' in record:
+                    record['columns']['tables']['holdings'] = table_columns(holdings)
+        except Exception:
+            pass
+    return ticker, record, False, metrics.to_dict(raw=True)
+
+
+class _HostGate:
+    '''
+    Per-host concurrency and rate limit for the fetch threads.
+    '''
+
+    def __init__(self, concurrency, rate):
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        if self.interval:
+            with self._lock:
+                now = time.monotonic()
+                delay = self.next_slot - now
+                self.next_slot = max(now, self.next_slot) + self.interval
+            if delay > 0:
+                time.sleep(delay)
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+
+
+class Pipeline:
+    def __init__(self, fetch_workers=16, parse_workers=None, queue_size=64,
+                 parser="lxml.html", retries=3, backoff=1.0, host_limits=None,
+                 default_limit=(4, None), sources=None, session=None, metrics=None,
+                 columns=False):
+        '''
+        fetch_workers: fetch threads.
+        parse_workers: parse processes, defaults to the number of cores.
+        queue_size: bound of the fetched-pages queue; fetch threads block
+        when parsing falls behind. At most 2 * parse_workers pages are
+        being parsed or waiting for the writer.
+        host_limits, default_limit, retries, backoff: as in AsyncDownloader.
+        metrics: Metrics receiving the fetch, parse (from the workers) and
+        write timings, defaults to the shared one.
+        columns: records also carry 'columns', the column-wise export
+        document of ETFExport.
+        '''
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.parser = parser
+        self.retries = retries
+        self.backoff = backoff
+        self.host_limits = host_limits if host_limits is not None else HOST_LIMITS
+        self.default_limit = default_limit
+        self.sources = sources if sources is not None else ETF.SOURCES
+        if session is None:
+            session = HttpSession(max_per_host=fetch_workers, store=MemoryStore())
+        self.session = session
+        self.metrics = metrics if metrics is not None else shared_metrics()
+        self.columns = columns
+        self.stats = {}
+        self._cancel = threading.Event()
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        '''
+        Stop starting new work; records already parsed are still written.
+        '''
+        self._cancel.set()
+
+    def run(self, tickers, sink, progress=True):
+        '''
+        Scrape all tickers. sink(ticker, record, error) is called from the
+        single writer thread; record is {'doc': toDict(), 'page_hashes': ...}
+        (and 'columns' with columns=True) or None with the error. Ctrl-C cancels gracefully.
+        Returns the run stats, including per-stage queue depths.
+        '''
+        tickers = [str(ticker).upper() for ticker in tickers]
+        self._cancel.clear()
+        self.stats = {'etfs': 0, 'errors': 0, 'fetches': 0, 'retries': 0,
+                      'zacks': 0, 'pool_restarts': 0, 'cancelled': False, 'seconds': 0,
+                      'queues': {name: {'max': 0, 'mean': 0}
+                                 for name in ('fetch', 'parse', 'parsing', 'write')}}
+        self._pending = len(tickers)
+        self._done = threading.Event()
+        if not tickers:
+            return self.stats
+        self._fetch_queue = queue.Queue()
+        self._parse_queue = queue.Queue(self.queue_size)
+        self._write_queue = queue.Queue()
+        self._inflight = threading.BoundedSemaphore(2 * self.parse_workers)
+        self._parsing = 0
+        for ticker in tickers:
+            self._fetch_queue.put((ticker, {}, None))
+        pbar = tqdm(total=len(tickers), unit="ETF") if progress else None
+        start = time.monotonic()
+
+        self._pool = ProcessPoolExecutor(self.parse_workers)
+        try:
+            threads = [threading.Thread(target=self._fetcher, daemon=True)
+                       for _ in range(self.fetch_workers)]
+            threads.append(threading.Thread(target=self._dispatcher, daemon=True))
+            writer = threading.Thread(target=self._writer, args=(sink, pbar), daemon=True)
+            threads.append(writer)
+            threads.append(threading.Thread(target=self._monitor, daemon=True))
+            for thread in threads:
+                thread.start()
+            try:
+                while not self._done.wait(0.2):
+                    if self._cancel.is_set() and self._parsing == 0 and self._write_queue.empty():
+                        break
+            except KeyboardInterrupt:
+                self.cancel()
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self.stats['cancelled'] = self._cancel.is_set()
+            self._cancel.set()  # stops every stage
+            self._write_queue.put(None)
+            # the sink may still be writing: wait for it, so the caller can
+            # flush and close its outputs safely
+            writer.join()
+            for thread in threads:
+                thread.join(1)
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        self.stats['seconds'] = time.monotonic() - start
+        if pbar is not None:
+            pbar.close()
+        return self.stats
+
+    def _finish(self):
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._done.set()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    # fetch stage
+
+    def _gate(self, url):
+        hostname = urllib.parse.urlsplit(url).hostname or ''
+        key = next((suffix for suffix in self.host_limits
+                    if hostname == suffix or hostname.endswith('.' + suffix)),
+                   hostname)
+        with self._lock:
+            if key not in self._gates:
+                self._gates[key] = _HostGate(*self.host_limits.get(key, self.default_limit))
+            return self._gates[key]
+
+    def _get(self, source, ticker):
+        url = self.sources[source].format(ticker)
+        with self.metrics.time('fetch', source=source):
+            return self._retry(url)
+
+    def _retry(self, url):
+        for attempt in range(self.retries + 1):
+            with self._gate(url):
+                self._count('fetches')
+                try:
+                    return self.session.get(url)
+                except urllib.error.HTTPError as e:
+                    if (e.code not in RETRY_STATUS or attempt == self.retries or
+                            getattr(self.session, 'offline', False)):
+                        raise
+                except OSError:
+                    if attempt == self.retries:
+                        raise
+            self._count('retries')
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _fetcher(self):
+        while not self._cancel.is_set():
+            try:
+                ticker, pages, record = self._fetch_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                if record is None:
+                    pages['etfdb'] = self._get('etfdb', ticker)
+                    sources = ('holdings',)
+                else:  # no holdings on etfdailynews, fall back to Zacks
+                    sources = ('zacks',)
+                    self._count('zacks')
+                for source in sources:
+                    try:
+                        pages[source] = self._get(source, ticker)
+                    except OSError:
+                        pages[source] = None
+            except Exception as e:
+                self._write_queue.put((ticker, None, e))
+                continue
+            while not self._cancel.is_set():
+                try:  # blocks while parsing is behind (backpressure)
+                    self._parse_queue.put((ticker, pages, record), timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+
+    # parse stage
+
+    def _submit(self, ticker, pages, record):
+        '''
+        Submit a parse task, replacing the pool once if a dead worker broke it.
+        '''
+        for attempt in range(2):
+            pool = self._pool
+            try:
+                if record is None:
+                    return pool.submit(parse_pages, ticker, pages, self.parser, self.columns)
+                return pool.submit(parse_zacks, ticker, record, pages.get('zacks'))
+            except BrokenProcessPool:
+                if attempt or self._cancel.is_set():
+                    raise
+                with self._lock:
+                    if self._pool is pool:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        self._pool = ProcessPoolExecutor(self.parse_workers)
+                        self.stats['pool_restarts'] += 1
+
+    def _dispatcher(self):
+        while not self._cancel.is_set():
+            try:
+                ticker, pages, record = self._parse_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            while not self._inflight.acquire(timeout=0.2):
+                if self._cancel.is_set():
+                    return
+            with self._lock:
+                self._parsing += 1
+            try:
+                future = self._submit(ticker, pages, record)
+            except BrokenProcessPool as e:
+                if self._cancel.is_set():
+                    return
+                # the replaced pool broke too: fail the ticker, keep going
+                with self._lock:
+                    self._parsing -= 1
+                self._inflight.release()
+                self._write_queue.put((ticker, None, e))
+                continue
+            except RuntimeError:
+                if self._cancel.is_set():  # pool shut down by cancel
+                    return
+                raise
+            future.ticker = ticker
+            future.add_done_callback(self._write_queue.put)
+
+    # write stage
+
+    def _writer(self, sink, pbar):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            if isinstance(item, tuple):  # fetch error
+                ticker, record, error = item
+            else:
+                with self._lock:
+                    self._parsing -= 1
+                self._inflight.release()
+                if item.cancelled() and self._cancel.is_set():
+                    continue
+                try:
+                    ticker, record, needs_zacks, metrics = item.result()
+                    self.metrics.merge(metrics)
+                    error = None
+                except Exception as e:
+                    ticker, record, needs_zacks, error = item.ticker, None, False, e
+                if needs_zacks:  # fetch Zacks, then parse only that page
+                    self._fetch_queue.put((ticker, {}, record))
+                    continue
+            try:
+                with self.metrics.time('write'):
+                    sink(ticker, record, error)
+            except Exception as e:
+                error = e
+            self._count('errors' if error is not None else 'etfs')
+            if pbar is not None:
+                pbar.set_postfix(parse_queue=self._parse_queue.qsize(),
+                                 parsing=self._parsing, errors=self.stats['errors'])
+                pbar.update()
+            self._finish()
+
+    # metrics
+
+    def _monitor(self, interval=0.1):
+        samples = 0
+        while not self._cancel.is_set() and not self._done.is_set():
+            depths = {'fetch': self._fetch_queue.qsize(), 'parse': self._parse_queue.qsize(),
+                      'parsing': self._parsing, 'write': self._write_queue.qsize()}
+            samples += 1
+            for name, depth in depths.items():
+                stats = self.stats['queues'][name]
+                stats['max'] = max(stats['max'], depth)
+                stats['mean'] += (depth - stats['mean']) / samples
+            time.sleep(interval)
@@ -0,0 +1,235 @@
+import numpy as np
+import pandas as pd
+
+"""
+Random-portfolio optimizer for the ETF universe, as in OptimalPortfolio.Rmd
+(PortfolioAnalytics optimize_method="random").
+The whole constrained candidate set is generated at once as a NumPy matrix
+and scored for every objective in one batched pass, chunk by chunk, so the
+min-var, min-ES and max-Sortino portfolios come from the same candidates
+and 10^6 candidates run in bounded memory.
+"""
+
+RISK_FREE_RATE = .028 / 12  # monthly, the Rmd MAR
+
+# Rmd constraints
+MIN_SUM, MAX_SUM = 0.99, 1.01
+BOX_MIN, BOX_MAX = 0.0, 0.5
+GROUP_MIN = (0.6, 0.2)
+GROUP_MAX = (0.8, 0.4)
+
+# objective -> the score it minimizes
+OBJECTIVES = {
+    'min_var': "variance - mean",
+    'min_es': "ES - mean",
+    'max_sortino': "-Sortino ratio",
+}
+
+
+class Constraints:
+    def __init__(self, n_assets, min_sum=MIN_SUM, max_sum=MAX_SUM, box_min=BOX_MIN,
+                 box_max=BOX_MAX, groups=None, group_min=None, group_max=None):
+        '''
+        groups: list of lists of asset positions, e.g. [stock, bond]; assets
+        in no group can take any weight within the box.
+        group_min, group_max: bounds of each group's total weight.
+        '''
+        self.n_assets = n_assets
+        self.min_sum = min_sum
+        self.max_sum = max_sum
+        self.box_min = box_min
+        self.box_max = box_max
+        groups = [list(group) for group in (groups or [])]
+        group_min = list(group_min if group_min is not None else [0.0] * len(groups))
+        group_max = list(group_max if group_max is not None else [max_sum] * len(groups))
+        grouped = {asset for group in groups for asset in group}
+        rest = [asset for asset in range(n_assets) if asset not in grouped]
+        if rest:
+            groups.append(rest)
+            group_min.append(0.0)
+            group_max.append(max_sum)
+        self.groups = groups
+        # bounds the box constraints also impose on each group
+        self.group_min = np.array([max(low, len(group) * box_min)
+                                   for group, low in zip(groups, group_min)])
+        self.group_max = np.array([min(high, len(group) * box_max)
+                                   for group, high in zip(groups, group_max)])
+        if (self.group_min > self.group_max).any() or \
+                self.group_min.sum() > max_sum or self.group_max.sum() < min_sum:
+            raise ValueError("Infeasible constraints")
+
+    @classmethod
+    def from_asset_classes(cls, asset_classes, labels=("Equity", "Bond"),
+                           group_min=GROUP_MIN, group_max=GROUP_MAX, **bounds):
+        '''
+        Rmd constraints with one group per asset class (stock, bond).
+        '''
+        asset_classes = list(asset_classes)
+        groups = [[i for i, asset_class in enumerate(asset_classes) if asset_class == label]
+                  for label in labels]
+        return cls(len(asset_classes), groups=groups, group_min=group_min,
+                   group_max=group_max, **bounds)
+
+    def valid(self, weights, tolerance=1e-9):
+        '''
+        Boolean mask of the candidate rows meeting every constraint.
+        '''
+        total = weights.sum(axis=1)
+        mask = (total >= self.min_sum - tolerance) & (total <= self.max_sum + tolerance)
+        mask &= (weights >= self.box_min - tolerance).all(axis=1)
+        mask &= (weights <= self.box_max + tolerance).all(axis=1)
+        for group, low, high in zip(self.groups, self.group_min, self.group_max):
+            group_total = weights[:, group].sum(axis=1)
+            mask &= (group_total >= low - tolerance) & (group_total <= high + tolerance)
+        return mask
+
+
+def fill(base, totals, capacity, shares):
+    '''
+    Spread totals - base.sum() over the columns in proportion to `shares`,
+    without exceeding base + capacity: whatever is cut at the caps is
+    spread again in proportion to the remaining capacity, which always fits
+    when the totals are feasible. All arguments are row-wise arrays.
+    '''
+    extra = (totals - base.sum(axis=1))[:, None]
+    shares = shares / np.maximum(shares.sum(axis=1, keepdims=True), 1e-300)
+    values = np.minimum(extra * shares, capacity)
+    excess = extra - values.sum(axis=1, keepdims=True)
+    room = capacity - values
+    room_total = room.sum(axis=1, keepdims=True)
+    values += np.divide(excess * room, room_total, out=np.zeros_like(room), where=room_total > 0)
+    return base + values
+
+
+def random_portfolios(constraints, size, rng=None):
+    '''
+    (size, n_assets) matrix of random weights meeting the constraints.
+    Totals are uniform within the weight-sum and group bounds; weights
+    within a group come from a Dirichlet draw with a random concentration
+    per candidate, from a few large positions to nearly equal weights.
+    '''
+    rng = np.random.default_rng(rng)
+    c = constraints
+    groups = len(c.groups)
+    low_total = max(c.min_sum, c.group_min.sum())
+    high_total = min(c.max_sum, c.group_max.sum())
+    totals = rng.uniform(low_total, high_total, size)
+    group_totals = fill(np.tile(c.group_min, (size, 1)), totals,
+                        np.tile(c.group_max - c.group_min, (size, 1)),
+                        rng.gamma(1.0, size=(size, groups)))
+    weights = np.empty((size, c.n_assets))
+    concentration = np.exp(rng.uniform(np.log(0.05), np.log(2.0), size))[:, None]
+    for g, group in enumerate(c.groups):
+        shares = rng.gamma(concentration, size=(size, len(group)))
+        weights[:, group] = fill(np.full((size, len(group)), c.box_min), group_totals[:, g],
+                                 np.full((size, len(group)), c.box_max - c.box_min), shares)
+    return weights[c.valid(weights)]
+
+
+def score(returns, weights, mar=RISK_FREE_RATE, p=0.95, covariance=None):
+    '''
+    Objectives of every candidate in one pass over the portfolio returns
+    (returns @ weights.T): mean, variance, historical ES at level p (the
+    mean of the worst (1 - p) returns, found with a partial sort), Sortino
+    ratio against `mar`, and the score of each OBJECTIVES entry.
+    covariance: assets x assets matrix (e.g. from RiskModel) for the
+    variance instead of the sample variance of the portfolio returns.
+    '''
+    portfolio = returns @ weights.T  # periods x candidates
+    periods = portfolio.shape[0]
+    mean = portfolio.mean(axis=0)
+    if covariance is not None:
+        var = ((weights @ covariance) * weights).sum(axis=1)
+    else:
+        var = portfolio.var(axis=0, ddof=1)
+    tail = max(int(np.ceil((1 - p) * periods)), 1)
+    es = -np.partition(portfolio, tail - 1, axis=0)[:tail].mean(axis=0)
+    downside = np.sqrt((np.minimum(portfolio - mar, 0) ** 2).sum(axis=0) / periods)
+    sortino = np.divide(mean - mar, downside, out=np.full_like(mean, -np.inf), where=downside > 0)
+    return {'mean': mean, 'var': var, 'es': es, 'sortino': sortino,
+            'min_var': var - mean, 'min_es': es - mean, 'max_sortino': -sortino}
+
+
+class RandomOptimizer:
+    def __init__(self, returns, constraints=None, asset_classes=None, search_size=10000,
+                 chunk_size=20000, risk_free=RISK_FREE_RATE, p=0.95, seed=None,
+                 covariance=None):
+        '''
+        returns: periods x assets DataFrame (or array) of returns, net of
+        expenses; NaN are taken as 0, as in the Rmd.
+        constraints: Constraints, or built from asset_classes (one per
+        asset) with the Rmd stock/bond groups.
+        search_size: candidates generated and scored, shared by all
+        objectives.
+        chunk_size: candidates held in memory at once.
+        covariance: assets x assets covariance (array or DataFrame, e.g.
+        RiskModelCache.covariance) used for the variance objective.
+        '''
+        if isinstance(returns, pd.DataFrame):
+            self.assets = list(returns.columns)
+            returns = returns.to_numpy(dtype=np.float64)
+        else:
+            returns = np.asarray(returns, dtype=np.float64)
+            self.assets = list(range(returns.shape[1]))
+        self.returns = np.nan_to_num(returns)
+        if constraints is None:
+            if asset_classes is not None:
+                constraints = Constraints.from_asset_classes(asset_classes)
+            else:
+                constraints = Constraints(self.returns.shape[1])
+        self.constraints = constraints
+        if isinstance(covariance, pd.DataFrame):
+            covariance = covariance.loc[self.assets, self.assets]
+        self.covariance = np.asarray(covariance, dtype=np.float64) if covariance is not None else None
+        self.search_size = search_size
+        self.chunk_size = chunk_size
+        self.risk_free = risk_free
+        self.p = p
+        self.rng = np.random.default_rng(seed)
+        self.evaluated = 0
+        self.results = None  # last optimize() result
+
+    def candidates(self):
+        '''
+        Generator of candidate chunks until search_size are produced.
+        '''
+        produced = 0
+        while produced < self.search_size:
+            size = min(self.chunk_size, self.search_size - produced)
+            chunk = random_portfolios(self.constraints, size, self.rng)
+            if len(chunk) == 0:
+                raise ValueError("No candidate meets the constraints")
+            produced += len(chunk)
+            yield chunk
+
+    def optimize(self, objectives=tuple(OBJECTIVES)):
+        '''
+        Best portfolio of each objective:
+        {objective: {'weights': Series, 'mean', 'var', 'es', 'sortino'}},
+        also kept as `results`.
+        '''
+        best = {objective: None for objective in objectives}
+        self.evaluated = 0
+        for chunk in self.candidates():
+            scores = score(self.returns, chunk, self.risk_free, self.p, self.covariance)
+            self.evaluated += len(chunk)
+            for objective in objectives:
+                i = int(np.argmin(scores[objective]))
+                if best[objective] is None or scores[objective][i] < best[objective][0]:
+                    best[objective] = (scores[objective][i], chunk[i].copy(),
+                                       {name: float(scores[name][i])
+                                        for name in ('mean', 'var', 'es', 'sortino')})
+        self.results = {objective: dict(weights=pd.Series(weights, index=self.assets), **stats)
+                        for objective, (value, weights, stats) in best.items()}
+        return self.results
+
+    def weights(self, objectives=tuple(OBJECTIVES), results=None):
+        '''
+        assets x objectives DataFrame of the optimal weights, like the Rmd
+        "Portfolios Weights" table, from `results` or the last optimize()
+        run (which is only run when it did not cover the objectives).
+        '''
+        results = results if results is not None else self.results
+        if results is None or any(objective not in results for objective in objectives):
+            results = self.optimize(objectives)
+        return pd.DataFrame({objective: results[objective]['weights'] for objective in objectives})
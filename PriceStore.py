@@ -0,0 +1,192 @@
+from Backtest import net_returns
+from collections import OrderedDict
+import numpy as np
+import os
+import pandas as pd
+import threading
+
+"""
+Local price history of the ETFs, keyed by the tickers of the details
+collection.
+Each ticker is an append-only binary file of (day, adjusted close) records
+read through a memory map, so CSV dumps are ingested incrementally and a
+query only touches the days it needs. returns() builds the aligned,
+expense-adjusted monthly returns matrix the Rmd gets from getSymbols +
+monthlyReturn + sweep, and caches it per (tickers, window).
+"""
+
+RECORD = np.dtype([('day', '<i8'), ('close', '<f8')])  # days since 1970-01-01
+
+# CSV columns holding the ticker and the (adjusted) close, first found wins
+TICKER_COLUMNS = ('Ticker', 'ticker', 'Symbol', 'symbol')
+CLOSE_COLUMNS = ('Adj Close', 'Adj_Close', 'adjusted', 'Adjusted', 'adj_close', 'Close', 'close')
+DATE_COLUMNS = ('Date', 'date', 'Datetime', 'timestamp')
+
+
+def to_days(dates):
+    return pd.DatetimeIndex(dates).normalize().asi8 // (24 * 60 * 60 * 10 ** 9)
+
+
+def from_days(days):
+    return pd.DatetimeIndex(np.asarray(days, dtype='<i8').astype('datetime64[D]'))
+
+
+def monthly_returns(days, closes):
+    '''
+    Monthly returns of a price series, as quantmod monthlyReturn: from the
+    last close of each month to the next; the first month starts from its
+    first close. Indexed by month end.
+    '''
+    if len(days) == 0:
+        return pd.Series(dtype=np.float64, index=pd.DatetimeIndex([]))
+    months = from_days(days).to_period('M')
+    last = pd.Series(closes, index=months).groupby(level=0).last()
+    previous = last.shift(1)
+    previous.iloc[0] = closes[0]
+    returns = last / previous - 1
+    returns.index = returns.index.to_timestamp('M')
+    return returns
+
+
+def first_of(columns, candidates):
+    return next((column for column in candidates if column in columns), None)
+
+
+class PriceStore:
+    def __init__(self, root="prices", cache_size=64):
+        '''
+        root: directory of the per-ticker <TICKER>.bin files.
+        cache_size: returns() results kept (least recently used dropped).
+        '''
+        self.root = root
+        self.cache_size = cache_size
+        os.makedirs(root, exist_ok=True)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, ticker):
+        return os.path.join(self.root, ticker.upper() + ".bin")
+
+    def tickers(self):
+        return sorted(name[:-4] for name in os.listdir(self.root) if name.endswith(".bin"))
+
+    def series(self, ticker):
+        '''
+        Memory-mapped (day, close) records of a ticker, oldest first.
+        '''
+        path = self._path(ticker)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=RECORD)
+        return np.memmap(path, dtype=RECORD, mode='r')
+
+    def size(self, ticker):
+        path = self._path(ticker)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def last_day(self, ticker):
+        records = self.series(ticker)
+        return int(records['day'][-1]) if len(records) else None
+
+    def append(self, ticker, dates, closes):
+        '''
+        Append the prices newer than the last stored day; older or repeated
+        days are ignored. Returns the number of days added.
+        '''
+        ticker = ticker.upper()
+        frame = pd.DataFrame({'day': to_days(dates), 'close': np.asarray(closes, dtype=np.float64)})
+        frame = frame.dropna().drop_duplicates('day', keep='last').sort_values('day')
+        last = self.last_day(ticker)
+        if last is not None:
+            frame = frame[frame['day'] > last]
+        if frame.empty:
+            return 0
+        records = np.empty(len(frame), dtype=RECORD)
+        records['day'] = frame['day'].to_numpy()
+        records['close'] = frame['close'].to_numpy()
+        with self._lock:
+            with open(self._path(ticker), 'ab') as f:
+                f.write(records.tobytes())
+        return len(records)
+
+    def ingest_csv(self, path, ticker=None):
+        '''
+        Append a CSV dump: one ticker per file (Date, ..., Adj Close, as
+        downloaded from Yahoo; the ticker defaults to the file name) or a
+        long file with a Ticker/Symbol column. Returns {ticker: days added}.
+        '''
+        frame = pd.read_csv(path)
+        date = first_of(frame.columns, DATE_COLUMNS)
+        close = first_of(frame.columns, CLOSE_COLUMNS)
+        if date is None or close is None:
+            raise ValueError("{}: no date or close column".format(path))
+        frame[date] = pd.to_datetime(frame[date], utc=True).dt.tz_localize(None)
+        frame[close] = pd.to_numeric(frame[close], errors='coerce')
+        column = first_of(frame.columns, TICKER_COLUMNS)
+        if column is None:
+            ticker = ticker or os.path.splitext(os.path.basename(path))[0]
+            return {ticker.upper(): self.append(ticker, frame[date], frame[close])}
+        return {str(name).upper(): self.append(str(name), group[date], group[close])
+                for name, group in frame.groupby(column)}
+
+    def returns(self, tickers, start=None, end=None, expense_ratios=None):
+        '''
+        months x tickers DataFrame of monthly returns from the prices in
+        [start, end], aligned on month ends, minus expense_ratios / 12 (a
+        {ticker: ratio} dict or a list in ticker order) and with NaN as 0,
+        as in the Rmd. Tickers without prices are all 0.
+        Results are cached per (tickers, window, expense ratios); any append,
+        also from another process, changes the file sizes in the key.
+        '''
+        tickers = [ticker.upper() for ticker in tickers]
+        if isinstance(expense_ratios, dict):
+            expense_ratios = [expense_ratios.get(ticker) or 0 for ticker in tickers]
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        key = (tuple(tickers), start, end,
+               tuple(expense_ratios) if expense_ratios is not None else None,
+               tuple(self.size(ticker) for ticker in tickers))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key].copy()
+        columns = {}
+        low = to_days([start])[0] if start is not None else None
+        high = to_days([end])[0] if end is not None else None
+        for ticker in tickers:
+            records = self.series(ticker)
+            days = records['day']
+            first = np.searchsorted(days, low, 'left') if low is not None else 0
+            last = np.searchsorted(days, high, 'right') if high is not None else len(days)
+            columns[ticker] = monthly_returns(days[first:last], records['close'][first:last])
+        frame = pd.DataFrame(columns, columns=tickers).sort_index()
+        frame.index = pd.DatetimeIndex(frame.index)  # also when no ticker has prices
+        if expense_ratios is not None:
+            frame = net_returns(frame, expense_ratios)
+        else:
+            frame = frame.fillna(0)
+        with self._lock:
+            self._cache[key] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame.copy()
+
+
+def expense_ratios_from(collection, tickers):
+    '''
+    {ticker: expense_ratio} of the given tickers from the details collection.
+    '''
+    cursor = collection.find({'ticker': {'$in': [ticker.upper() for ticker in tickers]}},
+                             {'ticker': True, 'expense_ratio': True, '_id': False})
+    return {doc['ticker']: doc.get('expense_ratio') for doc in cursor}
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python " + sys.argv[0] + " store_dir prices.csv [prices.csv ...]")
+        sys.exit(1)
+    store = PriceStore(sys.argv[1])
+    for path in sys.argv[2:]:
+        for ticker, added in store.ingest_csv(path).items():
+            print("{:<8} {:>6} days added".format(ticker, added))
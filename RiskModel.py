@@ -0,0 +1,253 @@
+from collections import OrderedDict, deque
+import hashlib
+import numpy as np
+import pandas as pd
+import threading
+
+"""
+Covariance estimates for the optimizer and the backtest.
+Sample covariance of a few dozen months is noisy and ill-conditioned, so
+estimates are shrunk towards a scaled identity (Ledoit-Wolf 2004) or built
+from a few principal-component / explicit factors. Moments keeps the sums
+a rolling window needs for both, so a new month is an O(n^2) update
+instead of a full recomputation, and RiskModelCache hands out estimates
+keyed by (ticker set, window).
+"""
+
+METHODS = ("sample", "ledoit_wolf", "pca")
+
+
+class Moments:
+    '''
+    Running sums of a window of return rows: enough for the covariance and
+    the Ledoit-Wolf shrinkage intensity, updated row by row.
+    '''
+
+    def __init__(self, assets):
+        self.n = 0
+        self.s1 = np.zeros(assets)  # sum x_i
+        self.m11 = np.zeros((assets, assets))  # sum x_i x_j
+        self.m21 = np.zeros((assets, assets))  # sum x_i^2 x_j
+        self.m22 = np.zeros((assets, assets))  # sum x_i^2 x_j^2
+
+    def add(self, x, sign=1):
+        x = np.asarray(x, dtype=np.float64)
+        x2 = x * x
+        self.n += sign
+        self.s1 += sign * x
+        self.m11 += sign * np.outer(x, x)
+        self.m21 += sign * np.outer(x2, x)
+        self.m22 += sign * np.outer(x2, x2)
+
+    def remove(self, x):
+        self.add(x, -1)
+
+    @classmethod
+    def of(cls, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        moments = cls(rows.shape[1])
+        rows2 = rows * rows
+        moments.n = len(rows)
+        moments.s1 = rows.sum(axis=0)
+        moments.m11 = rows.T @ rows
+        moments.m21 = rows2.T @ rows
+        moments.m22 = rows2.T @ rows2
+        return moments
+
+    def mean(self):
+        return self.s1 / self.n
+
+    def covariance(self, ddof=1):
+        '''
+        Sample covariance (ddof=0: maximum likelihood, as Ledoit-Wolf uses).
+        '''
+        m = self.mean()
+        return (self.m11 - self.n * np.outer(m, m)) / (self.n - ddof)
+
+    def ledoit_wolf(self):
+        '''
+        (covariance, shrinkage): the ML covariance shrunk towards mu * I,
+        mu its average variance, with the Ledoit-Wolf optimal intensity.
+        The fourth moments of the centered returns come from the raw sums.
+        '''
+        n, p = self.n, len(self.s1)
+        m = self.mean()
+        cov = self.covariance(ddof=0)
+        variances = np.diag(cov)
+        mu = variances.sum() / p
+        # sum over rows and i, j of (x_i - m_i)^2 (x_j - m_j)^2
+        s2 = np.diag(self.m11)
+        mi, mj = m[:, None], m[None, :]
+        fourth = (self.m22 - 2 * self.m21 * mj - 2 * mi * self.m21.T + 4 * mi * mj * self.m11
+                  + s2[:, None] * mj ** 2 + mi ** 2 * s2[None, :]
+                  - 2 * mi * mj ** 2 * self.s1[:, None] - 2 * mi ** 2 * mj * self.s1[None, :]
+                  + n * mi ** 2 * mj ** 2).sum()
+        delta_ = (cov ** 2).sum()
+        beta = (fourth / n - delta_) / (p * n)
+        delta = (delta_ - 2 * mu * variances.sum() + p * mu ** 2) / p
+        shrinkage = 0.0 if delta <= 0 else min(max(beta, 0.0), delta) / delta
+        return (1 - shrinkage) * cov + shrinkage * mu * np.eye(p), shrinkage
+
+
+def pca_covariance(cov, factors=3):
+    '''
+    Covariance of `factors` principal components plus diagonal specific
+    variance: B diag(lambda) B' + D, keeping the total variance of each asset.
+    '''
+    values, vectors = np.linalg.eigh(cov)
+    top = np.argsort(values)[::-1][:factors]
+    loadings = vectors[:, top] * np.sqrt(np.maximum(values[top], 0))
+    common = loadings @ loadings.T
+    return common + np.diag(np.maximum(np.diag(cov) - np.diag(common), 0))
+
+
+def factor_covariance(returns, factors):
+    '''
+    Covariance from explicit factor returns (periods x factors, aligned with
+    returns): betas by least squares, beta cov(F) beta' + residual variances.
+    '''
+    x = np.asarray(returns, dtype=np.float64)
+    f = np.asarray(factors, dtype=np.float64)
+    design = np.column_stack([np.ones(len(f)), f])
+    coefficients, _, _, _ = np.linalg.lstsq(design, x, rcond=None)
+    betas = coefficients[1:].T
+    residuals = x - design @ coefficients
+    factor_cov = np.atleast_2d(np.cov(f, rowvar=False))
+    dof = max(len(x) - f.shape[1] - 1, 1)
+    return betas @ factor_cov @ betas.T + np.diag((residuals ** 2).sum(axis=0) / dof)
+
+
+def estimate(moments, method="ledoit_wolf", factors=3):
+    '''
+    Covariance matrix of a Moments with one of METHODS.
+    '''
+    if method == "sample":
+        return moments.covariance()
+    if method == "ledoit_wolf":
+        return moments.ledoit_wolf()[0]
+    if method == "pca":
+        return pca_covariance(moments.covariance(), factors)
+    raise ValueError("Unknown method " + str(method))
+
+
+class RollingRiskModel:
+    def __init__(self, assets, window=36, method="ledoit_wolf", factors=3, refresh=None):
+        '''
+        Rolling-window estimate over the last `window` rows of returns.
+        assets: asset labels, in column order.
+        refresh: rows between full recomputations of the sums, bounding
+        floating point drift (default: the window).
+        '''
+        self.assets = list(assets)
+        self.window = window
+        self.method = method
+        self.factors = factors
+        self.refresh = refresh or window
+        self.rows = deque()
+        self.moments = Moments(len(self.assets))
+        self._updates = 0
+        self._estimate = None
+
+    def push(self, row):
+        '''
+        Add the returns of a new period, dropping the oldest beyond the window.
+        '''
+        row = np.nan_to_num(np.asarray(row, dtype=np.float64))
+        self.rows.append(row)
+        self.moments.add(row)
+        if len(self.rows) > self.window:
+            self.moments.remove(self.rows.popleft())
+        self._updates += 1
+        if self._updates % self.refresh == 0:
+            self.moments = Moments.of(list(self.rows))
+        self._estimate = None
+
+    def extend(self, returns):
+        for row in np.asarray(returns, dtype=np.float64):
+            self.push(row)
+
+    def covariance(self):
+        '''
+        Current estimate as an assets x assets DataFrame.
+        '''
+        if self._estimate is None:
+            self._estimate = pd.DataFrame(estimate(self.moments, self.method, self.factors),
+                                          index=self.assets, columns=self.assets)
+        return self._estimate
+
+    def shrinkage(self):
+        return self.moments.ledoit_wolf()[1]
+
+    @classmethod
+    def rolling(cls, returns, window=36, **options):
+        '''
+        Generator of (date, covariance) for every full window of a
+        periods x assets returns DataFrame, one incremental update per period.
+        '''
+        model = cls(returns.columns, window, **options)
+        for date, row in zip(returns.index, returns.to_numpy(dtype=np.float64)):
+            model.push(row)
+            if len(model.rows) == window:
+                yield date, model.covariance()
+
+
+class RiskModelCache:
+    def __init__(self, prices=None, method="ledoit_wolf", factors=3, max_entries=128):
+        '''
+        Covariance estimates keyed by (ticker set, window).
+        prices: PriceStore used to build the returns of a window.
+        '''
+        self.prices = prices
+        self.method = method
+        self.factors = factors
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(returns):
+        '''
+        Index bounds, columns and content hash of a returns DataFrame.
+        '''
+        values = np.ascontiguousarray(returns.to_numpy(dtype=np.float64))
+        bounds = (returns.index[0], returns.index[-1]) if len(returns) else None
+        return (bounds, len(returns), tuple(str(column).upper() for column in returns.columns),
+                hashlib.sha1(values.tobytes()).hexdigest())
+
+    def covariance(self, tickers, start=None, end=None, returns=None, expense_ratios=None):
+        '''
+        Covariance DataFrame of `tickers` over the window [start, end], from
+        `returns` (periods x tickers) or the price store. The same ticker set
+        in any order and window (and the same `returns` content, if given)
+        is computed once.
+        '''
+        tickers = [str(ticker).upper() for ticker in tickers]
+        if isinstance(expense_ratios, dict):
+            expense_ratios = {str(ticker).upper(): ratio for ticker, ratio in expense_ratios.items()}
+            expense_ratios = [expense_ratios.get(ticker) or 0 for ticker in sorted(tickers)]
+        key = (frozenset(tickers), start, end, self.method, self.factors,
+               tuple(expense_ratios) if expense_ratios is not None else None,
+               # appended prices invalidate the estimate
+               tuple(self.prices.size(ticker) for ticker in sorted(tickers))
+               if returns is None and self.prices is not None else None,
+               self.fingerprint(returns) if returns is not None else None)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if cached is None:
+            if returns is None:
+                returns = self.prices.returns(sorted(tickers), start, end, expense_ratios)
+            returns = returns.rename(columns=lambda column: str(column).upper())[sorted(tickers)]
+            moments = Moments.of(returns.fillna(0).to_numpy(dtype=np.float64))
+            cached = pd.DataFrame(estimate(moments, self.method, self.factors),
+                                  index=sorted(tickers), columns=sorted(tickers))
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = cached
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return cached.loc[tickers, tickers]